@@ -1,19 +1,152 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from contextlib import asynccontextmanager
 from formats import TextsInputs, Output
 from loaders import load_metric
+from micro_batching import MicroBatcher, QueueFullError
+from ndjson_streaming import stream_text_results
+from instrumentation import Instrumentation, process_memory
+from functools import partial
+import asyncio
+import os
 
-app = FastAPI()
+# the metric is loaded in background after the server has started, see /ready
+batcher = MicroBatcher(
+    metric=None,
+    max_batch_size=int(os.environ.get("METRIC_MAX_BATCH_SIZE", 256)),
+    max_wait_ms=float(os.environ.get("METRIC_MAX_WAIT_MS", 10)),
+    max_queue_size=int(os.environ.get("METRIC_MAX_QUEUE_SIZE", 10000))
+)
 
-metric = load_metric()
+max_request_bytes = int(os.environ.get("METRIC_MAX_REQUEST_BYTES", 100 * 1024 * 1024))
+max_text_length = int(os.environ.get("METRIC_MAX_TEXT_LENGTH", 100000))
+stream_chunk_size = int(os.environ.get("METRIC_STREAM_CHUNK_SIZE", 64))
+# 0: texts are analyzed whole
+max_document_chars = int(os.environ.get("METRIC_MAX_DOCUMENT_CHARS", 0)) or None
+# 0: texts are passed through stanza whole
+window_chars = int(os.environ.get("METRIC_WINDOW_CHARS", 0)) or None
+
+startup_state = {"ready": False, "error": None, "timings": {}}
+
+# per-stage latencies and counts of the metric, exported at /metrics
+instrumentation = Instrumentation() if os.environ.get("METRIC_INSTRUMENTATION", "1") == "1" else None
+
+
+def load_metric_kwargs() -> dict:
+    """load_metric arguments of the server, from the environment variables"""
+    return dict(
+        parallel=os.environ.get("METRIC_PARALLEL_LOAD", "1") == "1",
+        warmup=os.environ.get("METRIC_WARMUP", "1") == "1",
+        instrumentation=instrumentation,
+        cascade=os.environ.get("METRIC_NER_CASCADE", "0") == "1",
+        max_document_chars=max_document_chars,
+        window_chars=window_chars
+    )
+
+
+async def load_metric_in_background():
+    try:
+        batcher.metric = await asyncio.get_running_loop().run_in_executor(None, partial(
+            load_metric, timings=startup_state["timings"], **load_metric_kwargs()
+        ))
+        startup_state["ready"] = True
+    except Exception as e:
+        startup_state["error"] = f"{type(e).__name__}: {e}"
+
+
+def set_metric(metric, timings: dict):
+    """use a metric that was loaded before the server started (see serve.py) instead of loading it in background"""
+    batcher.metric = metric
+    startup_state["timings"].update(timings)
+    startup_state["ready"] = True
+
+
+def check_ready():
+    if not startup_state["ready"]:
+        raise HTTPException(status_code=503, detail=startup_state["error"] or "the metric is still loading")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await batcher.start()
+    loading_task = None if startup_state["ready"] else asyncio.create_task(load_metric_in_background())
+    yield
+    if loading_task is not None:
+        loading_task.cancel()
+    await batcher.stop()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.get("/health")
+async def health():
+    """liveness: the server is up, the metric may still be loading"""
+    return {"status": "ok"}
+
+
+@app.get("/ready")
+async def ready():
+    """readiness: 200 with the loading timings once the metric is loaded, 503 before it (or if loading failed)"""
+    check_ready()
+    return {"status": "ready", "timings": startup_state["timings"]}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """per-stage latency histograms, processed texts / sentences / tokens and predictions per NER module,
+    in the Prometheus text format"""
+    if instrumentation is None:
+        raise HTTPException(status_code=404, detail="instrumentation is disabled")
+
+    instrumentation.set_gauge("ready", int(startup_state["ready"]), help="Whether the metric is loaded")
+    instrumentation.set_gauge("queued_texts", batcher.num_queued_texts, help="Texts waiting in the micro-batching queue")
+    for component, seconds in list(startup_state["timings"].items()):
+        instrumentation.set_gauge("load_seconds", seconds, help="Loading time of the metric components",
+                                  component=component)
+    for kind, value in process_memory().items():
+        instrumentation.set_gauge("worker_memory_bytes", value, help="Resident memory of the worker process", kind=kind)
+
+    # with several workers (serve.py) every worker records on its own and every scrape is answered by one of them:
+    # the pid label keeps the series of the workers apart, they are summed in the queries
+    return PlainTextResponse(instrumentation.render(pid=os.getpid()), media_type="text/plain; version=0.0.4")
 
 
 @app.post("/calculate/", response_model=Output)
 async def calculate_metric(input: TextsInputs):
-    global metric
-    pred_dict = metric.calculate(texts=input.texts)
+    check_ready()
+    try:
+        pred_dict = await batcher.submit(texts=input.texts)
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
     return {"report": pred_dict}
 
 
+@app.post("/calculate/stream/")
+async def calculate_metric_stream(request: Request):
+    """Body: NDJSON, one text per line, either {"text": "..."} or a JSON string.
+    Response: NDJSON with a line per text as soon as it is done
+    ({"index", "num_sentences", "num_tokens", "broken_tokens", "broken_sentences"} or {"index", "error"}),
+    then the last line {"report": {...}} with the aggregate report of all the texts"""
+    check_ready()
+    content_length = request.headers.get("content-length")
+    if content_length is not None and not content_length.strip().isdigit():
+        raise HTTPException(status_code=400, detail="invalid Content-Length header")
+    if content_length is not None and int(content_length) > max_request_bytes:
+        raise HTTPException(status_code=413, detail=f"request body is larger than {max_request_bytes} bytes")
+
+    return StreamingResponse(
+        stream_text_results(
+            batcher=batcher,
+            byte_chunks=request.stream(),
+            chunk_size=stream_chunk_size,
+            max_request_bytes=max_request_bytes,
+            max_text_length=max_text_length
+        ),
+        media_type="application/x-ndjson"
+    )
+
+
 if __name__ == '__main__':
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8008)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=8008)
@@ -0,0 +1,40 @@
+from ner_utils import TransformersNER, compare_ner_spans
+import argparse
+import time
+
+
+def check_backend(backend: str,
+                  corpus_path: str = "ner_reference_corpus.txt",
+                  modelname: str = "EvanD/xlm-roberta-base-ukrainian-ner-ukrner",
+                  num_threads: int = None):
+    """run the reference fp32 TransformersNER and the one with the selected backend on the reference corpus,
+    compare their entity spans and speed"""
+
+    sentences = [s.strip() for s in open(corpus_path, "r").read().split("\n") if s.strip()]
+    sentences_ranges = [{"start": 0, "end": len(s)} for s in sentences]
+
+    report = {"backend": backend, "num_sentences": len(sentences)}
+    preds = {}
+    for name in ["torch", backend]:
+        ner = TransformersNER(modelname=modelname, backend=name, num_threads=num_threads)
+        # warm up
+        ner(sentences=sentences[:1], sentences_ranges=sentences_ranges[:1])
+
+        start_time = time.perf_counter()
+        preds[name] = ner(sentences=sentences, sentences_ranges=sentences_ranges)
+        report[name + "_seconds"] = time.perf_counter() - start_time
+
+    report["speedup"] = report["torch_seconds"] / report[backend + "_seconds"]
+    report.update(compare_ner_spans(reference_preds=preds["torch"], candidate_preds=preds[backend]))
+
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare a TransformersNER backend with the fp32 model")
+    parser.add_argument("--backend", default="onnx", choices=TransformersNER.BACKENDS)
+    parser.add_argument("--corpus", default="ner_reference_corpus.txt")
+    parser.add_argument("--num_threads", type=int, default=None)
+    args = parser.parse_args()
+
+    print(check_backend(backend=args.backend, corpus_path=args.corpus, num_threads=args.num_threads))
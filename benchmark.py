@@ -0,0 +1,300 @@
+from code_switching_ner_metric import CodeSwitchingNERMetric
+from ner_utils import BaseNER
+from preprocessing import Preprocessor
+from metric_accumulator import MetricAccumulator
+from rule_artifacts import load_rule_modules
+from loaders import ORIGIN_ALPHABET
+from instrumentation import Instrumentation, ner_module_name
+import argparse
+import collections
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import time
+
+from typing import List, Dict, Union, Tuple, Any, Optional
+
+UKRAINIAN_WORDS = [
+    "я", "живу", "в", "місті", "сьогодні", "гарна", "погода", "ми", "працюємо", "над", "проєктом", "це", "дуже",
+    "цікаво", "книга", "дім", "вулиця", "робота", "навчання", "мова", "день", "час", "люди", "країна", "новини",
+    "швидко", "добре", "завжди", "разом", "читати", "писати", "говорити", "великий", "новий", "український", "їжак",
+    "ґанок", "європейський", "подвір'я", "щодня", "з", "і", "та", "на", "до", "що", "який", "наш", "їхній", "зараз"
+]
+ENGLISH_WORDS = [
+    "the", "best", "metric", "performance", "model", "deadline", "open", "weekend", "meeting", "feedback", "update",
+    "release", "cool", "actually", "anyway", "random", "laptop", "coffee", "basically", "awesome", "team", "okay"
+]
+# proper names, found by the stub models
+ENTITIES = [
+    "John Smith", "Taras Shevchenko", "Oxford University", "Kyiv", "London", "Google", "Microsoft", "Apple", "NASA",
+    "UNESCO", "Lviv", "OpenAI"
+]
+# spans that are found by the rule-based modules
+RULE_SPANS = [
+    "https://example.com/page", "report.pdf", "main.py", "XIV", "a priori", "E471", "5²", "'quoted text'",
+    "foo.com.ua", "python", "#новини", "ascii"
+]
+
+# number of the distinct sentences that the repeated sentences are drawn from
+BOILERPLATE_SIZE = 20
+
+
+def generate_texts(num_texts: int = 1000, sentences_per_text: int = 5, words_per_sentence: int = 12,
+                   entity_density: float = 0.1, codeswitch_density: float = 0.05, repeat_density: float = 0.0,
+                   seed: int = 0) -> List[str]:
+    """synthetic Ukrainian texts with English code switching, deterministic for the seed.
+
+    entity_density: float, share of the words that are proper names or spans found by the rule-based modules
+    codeswitch_density: float, share of the words that are (lowercase) English words, i.e. code switching
+    repeat_density: float, share of the sentences that repeat one of the first BOILERPLATE_SIZE generated sentences
+    """
+    rng = random.Random(seed)
+    texts = []
+    generated_sentences = []
+    for _ in range(num_texts):
+        sentences = []
+        for _ in range(sentences_per_text):
+            if repeat_density and generated_sentences and rng.random() < repeat_density:
+                sentences.append(rng.choice(generated_sentences[:BOILERPLATE_SIZE]))
+                continue
+
+            words = []
+            for _ in range(words_per_sentence):
+                draw = rng.random()
+                if draw < entity_density:
+                    words.append(rng.choice(ENTITIES if rng.random() < 0.5 else RULE_SPANS))
+                elif draw < entity_density + codeswitch_density:
+                    words.append(rng.choice(ENGLISH_WORDS))
+                else:
+                    words.append(rng.choice(UKRAINIAN_WORDS))
+            words[0] = words[0][:1].upper() + words[0][1:]
+            sentences.append(" ".join(words) + rng.choice([".", ".", ".", "!", "?"]))
+            generated_sentences.append(sentences[-1])
+        texts.append(" ".join(sentences))
+
+    return texts
+
+
+class StubSentenceNER(BaseNER):
+    """deterministic regex sentence splitter and tokenizer standing in for StanzaNER,
+    pairs of capitalized words are predicted as PER entities"""
+    sentence_pattern = re.compile(r"\S.*?(?:[.!?]+(?=\s|$)|$)", re.S)
+    token_pattern = re.compile(r"\w+|[^\w\s]")
+    entity_pattern = re.compile(r"\b[A-Z][a-z]+ [A-Z][a-z]+\b")
+
+    def pred_ner_sents(self, text: str) -> Tuple[
+        List[List[Dict[str, Union[int, str]]]],
+        List[str],
+        List[Dict[str, int]],
+        List[Dict[str, Union[str, int]]]
+    ]:
+        preds, sentences, sentences_ranges, tokens = [], [], [], []
+        for sentence_match in self.sentence_pattern.finditer(text):
+            sentence_tokens = list(self.token_pattern.finditer(sentence_match.group()))
+            if not sentence_tokens:
+                continue
+
+            start = sentence_match.start() + sentence_tokens[0].start()
+            end = sentence_match.start() + sentence_tokens[-1].end()
+            sentence = text[start: end]
+            sentences.append(sentence)
+            sentences_ranges.append({"start": start, "end": end})
+            preds.append([
+                {
+                    "text": entity_match.group(),
+                    "label": "PER",
+                    "start": start + entity_match.start(),
+                    "end": start + entity_match.end(),
+                    "start_in_sentence": entity_match.start(),
+                    "end_in_sentence": entity_match.end()
+                } for entity_match in self.entity_pattern.finditer(sentence)
+            ])
+            tokens += [
+                {
+                    "text": token_match.group(),
+                    "start": sentence_match.start() + token_match.start(),
+                    "end": sentence_match.start() + token_match.end()
+                } for token_match in sentence_tokens
+            ]
+
+        return preds, sentences, sentences_ranges, tokens
+
+
+class StubModelNER(BaseNER):
+    """deterministic regex "model" standing in for TransformersNER / SpacyNER"""
+    cost = 100
+    needs_tokens = False
+
+    def __init__(self, pattern: str, labelname: str):
+        self.pattern = pattern
+        self.compiled_pattern = re.compile(pattern)
+        self.labelname = labelname
+
+    def __call__(self, sentences: List[str], sentences_ranges: List[Dict[str, int]], **kwargs) -> List[List[Dict[str, Union[int, str]]]]:
+        return [
+            [
+                {
+                    "text": match.group(),
+                    "label": self.labelname,
+                    "start": sentence_range["start"] + match.start(),
+                    "end": sentence_range["start"] + match.end(),
+                    "start_in_sentence": match.start(),
+                    "end_in_sentence": match.end()
+                } for match in self.compiled_pattern.finditer(sentence)
+            ] for sentence, sentence_range in zip(sentences, sentences_ranges)
+        ]
+
+
+def build_stub_metric(cascade: bool = False) -> CodeSwitchingNERMetric:
+    """the metric of loaders.load_metric with the models replaced by the stubs, the rule-based modules are the real ones"""
+    return CodeSwitchingNERMetric(
+        origin_alphabet=ORIGIN_ALPHABET,
+        ner_modules=[
+            StubModelNER(pattern=r"\b[A-Z]{2,}\w*\b", labelname="ORG"),
+            StubModelNER(pattern=r"\b[A-Z][a-z]+\b", labelname="LOC")
+        ] + load_rule_modules(),
+        sentence_ner=StubSentenceNER(),
+        cascade=cascade
+    )
+
+
+def run_once(texts: List[str], batch_size: int, cascade: bool = False) -> Dict[str, Any]:
+    """one pass of the metric over the texts with the per-stage timings:
+    preprocess, sentence_split, every ner module, batch_assembly (building the Document of the batch, selecting the
+    sentences for the modules), merge, scoring"""
+    instrumentation = Instrumentation()
+    metric = build_stub_metric(cascade=cascade)
+    metric.instrumentation = instrumentation
+
+    accumulator = MetricAccumulator()
+    start_time = time.perf_counter()
+    for batch_start in range(0, len(texts), batch_size):
+        with instrumentation.stage("preprocess"):
+            batch_texts = [Preprocessor.preprocess(text=raw_text) for raw_text in texts[batch_start: batch_start + batch_size]]
+        with instrumentation.stage("ner_preds_total"):
+            document = metric.build_document(texts=[text for text in batch_texts if text])
+            spans = metric.predict_document_spans(document=document)
+
+        texts_results = iter(metric.analyze_document(document=document, spans=spans))
+        for text in batch_texts:
+            accumulator.add_text_result(text_result=next(texts_results) if text else None)
+    total_seconds = time.perf_counter() - start_time
+
+    seconds = collections.defaultdict(float, instrumentation.stages_seconds())
+    ner_names = [ner_module_name(idx, ner_module) for idx, ner_module in enumerate(metric.ner_modules)]
+    stages = {"preprocess": seconds["preprocess"], "sentence_split": seconds["sentence_split"]}
+    for name in ner_names:
+        stages[name] = seconds[name]
+    stages["batch_assembly"] = seconds["ner_preds_total"] - seconds["sentence_split"] - sum(seconds[name] for name in ner_names)
+    stages["merge"] = seconds["merge"]
+    stages["scoring"] = seconds["sentences_lang"] + seconds["broken_tokens"] + seconds["broken_sentences"]
+
+    return {"stages": stages, "total_seconds": total_seconds, "report": accumulator.report(),
+            "ner_skip": metric.ner_skip_stats(), "dedup": metric.dedup_stats(),
+            "cascade_modules_stats": metric.cascade_modules_stats}
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(num_texts: int = 1000, sentences_per_text: int = 5, words_per_sentence: int = 12,
+                  entity_density: float = 0.1, codeswitch_density: float = 0.05, repeat_density: float = 0.0,
+                  batch_size: int = 32, repeats: int = 3, seed: int = 0, cascade: bool = False) -> Dict[str, Any]:
+    """run the metric with the stub models repeats times over the synthetic texts, the timings are the minimums
+    over the repeats"""
+    config = dict(
+        num_texts=num_texts, sentences_per_text=sentences_per_text, words_per_sentence=words_per_sentence,
+        entity_density=entity_density, codeswitch_density=codeswitch_density, repeat_density=repeat_density,
+        batch_size=batch_size, repeats=repeats, seed=seed, cascade=cascade
+    )
+    texts = generate_texts(num_texts=num_texts, sentences_per_text=sentences_per_text,
+                           words_per_sentence=words_per_sentence, entity_density=entity_density,
+                           codeswitch_density=codeswitch_density, repeat_density=repeat_density, seed=seed)
+
+    runs = [run_once(texts=texts, batch_size=batch_size, cascade=cascade) for _ in range(repeats)]
+
+    total_seconds = min(run["total_seconds"] for run in runs)
+    report = runs[0]["report"]
+    return {
+        "config": config,
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "stages": {stage: min(run["stages"][stage] for run in runs) for stage in runs[0]["stages"]},
+        "total_seconds": total_seconds,
+        "texts_per_second": num_texts / total_seconds,
+        "tokens_per_second": report["total_num_tokens"] / total_seconds,
+        "ner_skip_rate": runs[0]["ner_skip"]["skip_rate"],
+        "ner_dedup_ratio": runs[0]["dedup"]["dedup_ratio"],
+        "cascade_modules_stats": runs[0]["cascade_modules_stats"],
+        "report": report
+    }
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any]) -> str:
+    """table of the stage timings against the baseline results (ratios > 1 are slowdowns)"""
+    lines = [f"{'stage':<40} {'baseline, s':>12} {'current, s':>12} {'ratio':>8}"]
+    for stage in list(results["stages"]) + ["total_seconds"]:
+        current = results["stages"].get(stage, results.get(stage))
+        previous = baseline["stages"].get(stage, baseline.get(stage))
+        if previous is None:
+            lines.append(f"{stage:<40} {'-':>12} {current:>12.4f} {'-':>8}")
+        else:
+            lines.append(f"{stage:<40} {previous:>12.4f} {current:>12.4f} {current / max(previous, 1e-9):>8.2f}")
+    if results["report"] != baseline["report"]:
+        lines.append("the metric report differs from the baseline")
+
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Offline benchmark of the metric on synthetic code-switched texts, with stub models instead of "
+                    "Stanza / transformers / spaCy and per-stage timings"
+    )
+    parser.add_argument("--num_texts", type=int, default=1000)
+    parser.add_argument("--sentences_per_text", type=int, default=5)
+    parser.add_argument("--words_per_sentence", type=int, default=12)
+    parser.add_argument("--entity_density", type=float, default=0.1,
+                        help="share of the words that are proper names or spans found by the rule-based modules")
+    parser.add_argument("--codeswitch_density", type=float, default=0.05,
+                        help="share of the words that are English words")
+    parser.add_argument("--repeat_density", type=float, default=0.0,
+                        help="share of the sentences that repeat an earlier sentence")
+    parser.add_argument("--batch_size", type=int, default=32)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cascade", action="store_true", help="run the NER modules as a cascade")
+    parser.add_argument("--output", default=None, help="path of the results JSON, stdout by default")
+    parser.add_argument("--compare", default=None, help="path of the results JSON of another commit to compare with")
+    args = parser.parse_args()
+
+    results = run_benchmark(
+        num_texts=args.num_texts, sentences_per_text=args.sentences_per_text,
+        words_per_sentence=args.words_per_sentence, entity_density=args.entity_density,
+        codeswitch_density=args.codeswitch_density, repeat_density=args.repeat_density, batch_size=args.batch_size,
+        repeats=args.repeats, seed=args.seed, cascade=args.cascade
+    )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    else:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            print(compare(results=results, baseline=json.load(f)), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,36 +1,377 @@
 from ner_utils import BaseNER
-from typing import List, Dict, Union, Tuple, Any
-from preprocessing import Preprocessor
+from document import Document, SpanList
+from typing import List, Dict, Union, Tuple, Any, Optional, Iterable, Iterator
+from intervals import IntervalIndex
+from result_cache import ResultCache
+from metric_accumulator import MetricAccumulator
+from instrumentation import Instrumentation, ner_module_name, stage
+import bisect
+import hashlib
+import itertools
 import re
+import warnings
+
+
+def warn_per_text_method(method_name: str):
+    """DeprecationWarning for the per-text scoring methods that analyze_document replaced"""
+    warnings.warn(
+        f"CodeSwitchingNERMetric.{method_name} is deprecated, the texts are scored in batches by analyze_document",
+        DeprecationWarning,
+        stacklevel=3
+    )
+
 
 class CodeSwitchingNERMetric:
     def __init__(self,
                  ner_modules: List[BaseNER],
                  sentence_ner: BaseNER,
-                 origin_alphabet: str ="АаБбВвГгҐґДдЕеЄєЖжЗзИиІіЇїЙйКкЛлМмНнОоПпРрСсТтУуФфХхЦцЧчШшЩщьЮюЯя"
+                 origin_alphabet: str ="АаБбВвГгҐґДдЕеЄєЖжЗзИиІіЇїЙйКкЛлМмНнОоПпРрСсТтУуФфХхЦцЧчШшЩщьЮюЯя",
+                 result_cache: Optional[ResultCache] = None,
+                 instrumentation: Optional[Instrumentation] = None,
+                 skip_native_sentences: bool = True,
+                 cascade: bool = False,
+                 deduplicate_sentences: bool = True
                  ):
+        """
+        result_cache: ResultCache, optional cache of the per-text analysis results. The texts found in it are not passed
+            through the sentence splitter and the NER modules again
+        instrumentation: Instrumentation, optional, records the latency of every stage and NER module and the counts
+            of the processed texts and predictions
+        skip_native_sentences: bool, do not run the self.ner_modules on the sentences that have native letters and no
+            foreign ones. None of their tokens can be broken whatever the predictions are, so the metric is the same
+        cascade: bool, run the self.ner_modules from the cheapest to the most expensive (by their cost), every module
+            only on the sentences that the earlier ones left unresolved (see find_unresolved_sentences).
+            The metric is the same, the per-module hits are in cascade_modules_stats
+        deduplicate_sentences: bool, run the modules that see only the sentence strings (needs_tokens = False) once per
+            distinct sentence of a batch, and copy their predictions to the repeats of the sentence. The savings are
+            in dedup_stats
+        """
         self.origin_alphabet = origin_alphabet
         self.ner_modules = ner_modules
         self.sentence_ner = sentence_ner
+        self.result_cache = result_cache
+        self.instrumentation = instrumentation
+        self.skip_native_sentences = skip_native_sentences
+        self.num_split_sentences, self.num_skipped_sentences = 0, 0
+        self.cascade = cascade
+        # per NER module (and the sentence splitter): sentences it ran on, predictions and hits in the cascade
+        self.cascade_modules_stats = {}
+        self.deduplicate_sentences = deduplicate_sentences
+        # sentences passed to the NER modules (summed over the modules) and how many of them the modules ran on
+        self.num_module_sentences, self.num_module_run_sentences = 0, 0
+
+        # alphabet classifiers are compiled once, they are used for every token and sentence
+        self.origin_alphabet_chars = frozenset(origin_alphabet)
+        # letters (word chars that are not digits) outside of the origin alphabet
+        self.foreign_letters_pattern = re.compile(r'[^' + re.escape(''.join(sorted(self.origin_alphabet_chars))) + r'\s\W\d]+')
+
+
+    def fingerprint(self) -> str:
+        """hash of the metric configuration: alphabet, sentence splitter and NER modules with their configurations"""
+        config = "\0".join(
+            [self.origin_alphabet, self.sentence_ner.fingerprint()] + [ner_model.fingerprint() for ner_model in self.ner_modules]
+        )
+        return hashlib.sha256(config.encode("utf-8")).hexdigest()
+
+    def check_if_lang_match(self, text:str) -> bool:
+        """whether the text includes at least one symbol of the origin alphabet"""
+        return not self.origin_alphabet_chars.isdisjoint(text)
+
+    def has_native_letters(self, texts: List[str]) -> List[bool]:
+        """check_if_lang_match for a batch of texts"""
+        origin_alphabet_chars = self.origin_alphabet_chars
+        return [not origin_alphabet_chars.isdisjoint(text) for text in texts]
+
+    def has_foreign_letters(self, texts: List[str]) -> List[bool]:
+        # texts are joined with "\n", which the pattern never matches, so a match never spans two texts
+        # texts are joined with a whitespace, so a match never spans two texts
+        texts_starts = []
+        position = 0
+        for text in texts:
+            texts_starts.append(position)
+            position += len(text) + 1
+
+        output = [False] * len(texts)
+        for match in self.foreign_letters_pattern.finditer("\n".join(texts)):
+            output[bisect.bisect_right(texts_starts, match.start()) - 1] = True
 
-
-    def check_if_lang_match(self, text:str) -> List[bool]:
-        include_at_least_one_alphabet_symbol = bool(re.findall(
-                "[" + self.origin_alphabet + "]+", text
-            ))
-
-        return include_at_least_one_alphabet_symbol
+        return output
 
     def is_sent_in_required_lang_ner(self, sent_text, sent_range_dict, sent_ner_preds):
-        if self.check_if_lang_match(sent_text):
+        """deprecated, the per-text check; analyze_document runs is_sentence_correct for the whole batch"""
+        warn_per_text_method("is_sent_in_required_lang_ner")
+        return self.is_sentence_correct(
+            sentence=sent_text,
+            sentence_start=sent_range_dict["start"],
+            intervals=[(ner_pred["start"], ner_pred["end"]) for ner_pred in sent_ner_preds]
+        )
+
+    def is_sentence_correct(self, sentence: str, sentence_start: int, intervals: List[Tuple[int, int]]) -> bool:
+        """is_sent_in_required_lang_ner with the predictions as (start, end) intervals"""
+        if self.check_if_lang_match(sentence):
             return True
 
-        left_sent_text = sent_text
-        for ner_pred in sent_ner_preds:
-            left_sent_text = left_sent_text[:ner_pred["start"]-sent_range_dict["start"]] + " "*(ner_pred["end"] - ner_pred["start"]) + left_sent_text[ner_pred["end"]-sent_range_dict["start"]:]
+        # the sentence is still correct if everything except spaces is covered by the predictions
+        left_sent_parts = []
+        uncovered_start = 0
+        for pred_start, pred_end in sorted((start - sentence_start, end - sentence_start) for start, end in intervals):
+            if pred_start > uncovered_start:
+                left_sent_parts.append(sentence[uncovered_start:pred_start])
+            uncovered_start = max(uncovered_start, pred_end)
+        left_sent_parts.append(sentence[uncovered_start:])
+
+        return not "".join(left_sent_parts).replace(" ", "")
+
+    def tokens_have_foreign_letters(self, document: Document) -> List[bool]:
+        """has_foreign_letters for all the tokens of the document, found once and kept in it"""
+        if document.tokens_have_foreign_letters is None:
+            document.tokens_have_foreign_letters = self.has_foreign_letters(document.tokens_texts)
+        return document.tokens_have_foreign_letters
+
+    @staticmethod
+    def add_spans_intervals(sentences_intervals: List[List[List[int]]], spans: SpanList):
+        """add the [start, end] of every span to the intervals of its sentence"""
+        for sentence_idx, start, end in zip(spans.sentences_idxs, spans.starts, spans.ends):
+            sentences_intervals[sentence_idx].append([start, end])
+
+    def find_ner_sentences(self, document: Document) -> List[int]:
+        """indices of the sentences that need the NER predictions: the ones with foreign letters, and the ones without
+        native letters (they are correct only if the predictions cover them), together with the rest of their groups
+        (see Document.sentences_groups). In the rest of the sentences no token has foreign letters and
+        is_sent_in_required_lang_ner is True, so the predictions would never be used"""
+        if not self.skip_native_sentences:
+            return list(range(len(document.sentences)))
+
+        needs_ner = [
+            has_foreign_letters or not has_native_letters for has_foreign_letters, has_native_letters in zip(
+                self.has_foreign_letters(document.sentences), self.has_native_letters(document.sentences)
+            )
+        ]
+        groups = document.sentences_groups()
+        ner_groups = {group for group, sentence_needs_ner in zip(groups, needs_ner) if sentence_needs_ner}
+
+        return [i for i, group in enumerate(groups) if group in ner_groups]
+
+    def init_cascade_state(self, document: Document) -> Dict[str, Any]:
+        """what find_unresolved_sentences needs for a batch: the sentences groups and the tokens with foreign letters
+        (with the sentence each of them belongs to), the sentence splitter predictions are counted as the first module"""
+        # a token outside of the sentences is broken whatever the predictions are
+        foreign_tokens = [
+            (token_start, token_end, token_sentence_idx)
+            for token_start, token_end, token_sentence_idx, has_foreign_letters in zip(
+                document.tokens_starts,
+                document.tokens_ends,
+                document.tokens_sentences_idxs,
+                self.tokens_have_foreign_letters(document)
+            ) if has_foreign_letters and token_sentence_idx != -1
+        ]
+
+        cascade_state = {
+            "groups": document.sentences_groups(),
+            "foreign_tokens": foreign_tokens,
+            "uncovered_foreign_tokens": foreign_tokens,
+        }
+        sentence_ner_stats = self.cascade_modules_stats.setdefault("sentence_ner", {"sentences": 0, "predictions": 0, "hits": 0})
+        sentence_ner_stats["sentences"] += len(document.sentences)
+        sentence_ner_stats["predictions"] += len(document.sentence_ner_spans)
+        sentence_ner_stats["hits"] += self.cover_foreign_tokens(cascade_state=cascade_state, spans=document.sentence_ner_spans)
+
+        return cascade_state
+
+    def find_unresolved_sentences(self, cascade_state: Dict[str, Any], document: Document,
+                                  sentences_intervals: List[List[List[int]]], sentences_idxs: List[int]) -> List[int]:
+        """the sentences (of sentences_idxs) of the groups that more predictions could still change the result of.
+        A group is resolved when all its sentences pass is_sent_in_required_lang_ner and every token with foreign letters
+        in it is covered by a prediction of the group: more predictions cannot make a sentence incorrect or a token
+        uncovered, so the later modules are not needed for it.
+        sentences_intervals: the predictions of every sentence so far, as [start, end]"""
+        groups = cascade_state["groups"]
+
+        unresolved_groups = set()
+        for i in sentences_idxs:
+            if groups[i] not in unresolved_groups and not self.is_sentence_correct(
+                    sentence=document.sentences[i],
+                    sentence_start=document.sentences_starts[i],
+                    intervals=sentences_intervals[i]
+            ):
+                unresolved_groups.add(groups[i])
+
+        sentences_idxs_set = set(sentences_idxs)
+        # predictions of the incorrect sentences are dropped by analyze_document, their groups are unresolved anyway
+        preds_index = IntervalIndex([
+            (start, end)
+            for i in sentences_idxs if groups[i] not in unresolved_groups
+            for start, end in sentences_intervals[i]
+        ])
+        for token_start, token_end, sentence_idx in cascade_state["foreign_tokens"]:
+            if sentence_idx in sentences_idxs_set and groups[sentence_idx] not in unresolved_groups:
+                if not preds_index.intersects(start=token_start, end=token_end):
+                    unresolved_groups.add(groups[sentence_idx])
+
+        return [i for i in sentences_idxs if groups[i] in unresolved_groups]
+
+    def count_cascade_hits(self, cascade_state: Dict[str, Any], ner_name: str, sentences_idxs: List[int], spans: SpanList):
+        """add the sentences the module ran on, its predictions and its hits (tokens with foreign letters that no
+        earlier module in the cascade covered) to self.cascade_modules_stats"""
+        module_stats = self.cascade_modules_stats.setdefault(ner_name, {"sentences": 0, "predictions": 0, "hits": 0})
+        module_stats["sentences"] += len(sentences_idxs)
+        module_stats["predictions"] += len(spans)
+
+        num_hits = self.cover_foreign_tokens(cascade_state=cascade_state, spans=spans)
+        module_stats["hits"] += num_hits
+
+        if self.instrumentation is not None:
+            self.instrumentation.count("ner_hits", num_hits, module=ner_name)
+
+    def cover_foreign_tokens(self, cascade_state: Dict[str, Any], spans: SpanList) -> int:
+        """remove the tokens covered by the spans from the uncovered tokens of the cascade, returns their number"""
+        preds_index = IntervalIndex(spans.intervals())
+        uncovered_foreign_tokens = [
+            foreign_token for foreign_token in cascade_state["uncovered_foreign_tokens"]
+            if not preds_index.intersects(start=foreign_token[0], end=foreign_token[1])
+        ]
+        num_covered = len(cascade_state["uncovered_foreign_tokens"]) - len(uncovered_foreign_tokens)
+        cascade_state["uncovered_foreign_tokens"] = uncovered_foreign_tokens
+
+        return num_covered
+
+    def ner_skip_stats(self) -> Dict[str, Union[int, float]]:
+        """number of the split sentences so far, how many of them the NER modules were skipped for, and the ratio"""
+        return {
+            "num_sentences": self.num_split_sentences,
+            "num_skipped_sentences": self.num_skipped_sentences,
+            "skip_rate": self.num_skipped_sentences / self.num_split_sentences if self.num_split_sentences else 0.0
+        }
+
+    def dedup_stats(self) -> Dict[str, Union[int, float]]:
+        """number of the sentences passed to the NER modules so far (summed over the modules), how many of them the
+        modules ran on after the deduplication, and the share of the runs saved"""
+        return {
+            "num_sentences": self.num_module_sentences,
+            "num_run_sentences": self.num_module_run_sentences,
+            "dedup_ratio": 1 - self.num_module_run_sentences / self.num_module_sentences if self.num_module_sentences else 0.0
+        }
+
+    def ner_run_counts(self) -> Dict[str, int]:
+        """raw counts of ner_skip_stats and dedup_stats so far, by the names of the MetricAccumulator counters"""
+        return {
+            "num_ner_split_sentences": self.num_split_sentences,
+            "num_ner_skipped_sentences": self.num_skipped_sentences,
+            "num_ner_module_sentences": self.num_module_sentences,
+            "num_ner_module_run_sentences": self.num_module_run_sentences
+        }
+
+    @staticmethod
+    def find_repeated_sentences(document: Document, sentences_idxs: List[int]) -> Tuple[List[int], Dict[int, List[int]]]:
+        """the first occurrence of every distinct sentence among sentences_idxs, and the other occurrences of the
+        sentences that repeat, by their first occurrence"""
+        first_occurrences = {}
+        repeated_sentences = {}
+        for i in sentences_idxs:
+            first_occurrence = first_occurrences.setdefault(document.sentences[i], i)
+            if first_occurrence != i:
+                repeated_sentences.setdefault(first_occurrence, []).append(i)
+
+        return list(first_occurrences.values()), repeated_sentences
+
+    @staticmethod
+    def copy_repeated_spans(document: Document, spans: SpanList, repeated_sentences: Dict[int, List[int]]) -> SpanList:
+        """add the spans of the first occurrences to the other occurrences of their sentences, at the same positions
+        in the sentence"""
+        starts = document.sentences_starts
+        for k in range(len(spans)):
+            first_occurrence = spans.sentences_idxs[k]
+            for sentence_idx in repeated_sentences.get(first_occurrence, ()):
+                shift = starts[sentence_idx] - starts[first_occurrence]
+                spans.append(sentence_idx, spans.starts[k] + shift, spans.ends[k] + shift, spans.labels[k])
+
+        return spans
+
+    def build_document(self, texts: List[str]) -> Document:
+        """split the texts by the self.sentence_ner in one bulk call, into one Document"""
+        with stage(self.instrumentation, "sentence_split"):
+            texts_sents = self.sentence_ner.pred_ner_sents_batch(texts)
+
+        return Document(texts=texts, texts_sents=texts_sents)
+
+    def predict_document_spans(self, document: Document) -> SpanList:
+        """predictions of the self.ner_modules for the document: each of them runs once on the sentences of the whole
+        batch that need predictions (see find_ner_sentences), the ones that see only the sentence strings once on every
+        distinct sentence (see find_repeated_sentences)"""
+        instrumentation = self.instrumentation
+        num_sentences = len(document.sentences)
+
+        # indices of the sentences the NER modules run on
+        ner_sentences_idxs = self.find_ner_sentences(document=document)
+
+        self.num_split_sentences += num_sentences
+        self.num_skipped_sentences += num_sentences - len(ner_sentences_idxs)
+        if instrumentation is not None:
+            instrumentation.count("ner_sentences", len(ner_sentences_idxs))
+            instrumentation.count("ner_skipped_sentences", num_sentences - len(ner_sentences_idxs))
+
+        spans = SpanList()
+
+        ner_modules = list(enumerate(self.ner_modules))
+        cascade_state, sentences_intervals = None, None
+        if self.cascade:
+            ner_modules.sort(key=lambda idx_module: idx_module[1].cost)
+            sentences_intervals = [[] for _ in range(num_sentences)]
+            self.add_spans_intervals(sentences_intervals=sentences_intervals, spans=document.sentence_ner_spans)
+            cascade_state = self.init_cascade_state(document=document)
+
+        # without the cascade all the modules are one tier
+        for _, tier_ner_modules in itertools.groupby(ner_modules, key=lambda idx_module: idx_module[1].cost if self.cascade else 0):
+            if cascade_state is not None:
+                ner_sentences_idxs = self.find_unresolved_sentences(
+                    cascade_state=cascade_state,
+                    document=document,
+                    sentences_intervals=sentences_intervals,
+                    sentences_idxs=ner_sentences_idxs
+                )
+            if not ner_sentences_idxs:
+                break
 
-        return not bool(left_sent_text.replace(" ", ""))
+            unique_sentences_idxs, repeated_sentences = ner_sentences_idxs, {}
+            if self.deduplicate_sentences:
+                unique_sentences_idxs, repeated_sentences = self.find_repeated_sentences(
+                    document=document, sentences_idxs=ner_sentences_idxs
+                )
 
+            for ner_idx, ner_model in tier_ner_modules:
+                ner_name = ner_module_name(ner_idx, ner_model)
+                # the predictions of the modules without the tokens depend only on the sentence string
+                deduplicated = bool(repeated_sentences) and not ner_model.needs_tokens
+                with stage(instrumentation, ner_name):
+                    if deduplicated:
+                        model_spans = self.copy_repeated_spans(
+                            document=document,
+                            spans=ner_model.predict_spans(document=document, sentences_idxs=unique_sentences_idxs),
+                            repeated_sentences=repeated_sentences
+                        )
+                    else:
+                        model_spans = ner_model.predict_spans(document=document, sentences_idxs=ner_sentences_idxs)
+
+                num_run_sentences = len(unique_sentences_idxs) if deduplicated else len(ner_sentences_idxs)
+                self.num_module_sentences += len(ner_sentences_idxs)
+                self.num_module_run_sentences += num_run_sentences
+                if instrumentation is not None:
+                    instrumentation.count("predictions", len(model_spans), module=ner_name)
+                    instrumentation.count(
+                        "ner_deduplicated_sentences", len(ner_sentences_idxs) - num_run_sentences, module=ner_name
+                    )
+                if cascade_state is not None:
+                    self.count_cascade_hits(
+                        cascade_state=cascade_state,
+                        ner_name=ner_name,
+                        sentences_idxs=ner_sentences_idxs,
+                        spans=model_spans
+                    )
+                    self.add_spans_intervals(sentences_intervals=sentences_intervals, spans=model_spans)
+
+                spans.extend(model_spans)
+
+        return spans
 
     def get_all_ner_preds_sentences(self, text: str) -> Tuple[
         List[List[Dict[str, Union[int, str]]]],
@@ -41,22 +382,44 @@ class CodeSwitchingNERMetric:
         """get NER predictions, sentences and token separation from the  self.sentence_ner;
         Get all predictions per sentence from the NER modules in self.ner_modules"""
 
-        ner_preds, sentences, sentences_ranges, tokens_dicts = self.sentence_ner.pred_ner_sents(text)
-
-
-
-        for ner_model in self.ner_modules:
-            model_preds = ner_model(
-                sentences=sentences,
-                sentences_ranges=sentences_ranges,
-                tokens_dicts=tokens_dicts
-            )
-
-            for i in range(len(model_preds)):
-                ner_preds[i] += model_preds[i]
+        return self.get_all_ner_preds_sentences_batch(texts=[text])[0]
 
+    def get_all_ner_preds_sentences_batch(self, texts: List[str]) -> List[Tuple[
+        List[List[Dict[str, Union[int, str]]]],
+        List[str],
+        List[Dict[str, int]],
+        List[Dict[str, Union[str, int]]]
+    ]]:
+        """get_all_ner_preds_sentences for a batch of texts, as dicts in the offsets of every text
+        (build_document and predict_document_spans)"""
+        document = self.build_document(texts=texts)
+        spans = self.predict_document_spans(document=document)
+
+        sentences_spans = [[] for _ in document.sentences]
+        for sentence_idx, start, end, label in zip(spans.sentences_idxs, spans.starts, spans.ends, spans.labels):
+            sentences_spans[sentence_idx].append((start, end, label))
+
+        output = []
+        for text, (ner_preds, sentences, sentences_ranges, tokens_dicts), offset, first_sentence_idx in zip(
+                document.texts, document.texts_sents, document.texts_offsets, document.texts_first_sentences
+        ):
+            text_ner_preds = []
+            for i in range(len(sentences)):
+                sentence_start = sentences_ranges[i]["start"]
+                text_ner_preds.append(ner_preds[i] + [
+                    {
+                        "text": text[start - offset: end - offset],
+                        "label": label,
+                        "start_in_sentence": start - offset - sentence_start,
+                        "end_in_sentence": end - offset - sentence_start,
+                        "start": start - offset,
+                        "end": end - offset,
+                    } for start, end, label in sentences_spans[first_sentence_idx + i]
+                ])
+
+            output.append((text_ner_preds, sentences, sentences_ranges, tokens_dicts))
 
-        return ner_preds, sentences, sentences_ranges, tokens_dicts
+        return output
 
     def mergeIntervals(self, intervals):
         """merge overlapping intervals"""
@@ -80,7 +443,9 @@ class CodeSwitchingNERMetric:
     def merge_preds(self,
                     text: str,
                     preds: List[Dict[str, Union[int, str]]]) -> List[Dict[str, Union[int, str]]]:
-        """Merge overlapping ner predictions"""
+        """Merge overlapping ner predictions.
+        Deprecated, analyze_document merges the spans of the whole batch"""
+        warn_per_text_method("merge_preds")
 
         if not preds:
             return []
@@ -104,16 +469,7 @@ class CodeSwitchingNERMetric:
     def find_non_vocab_words_starts(self, text: str) -> List[Tuple[int, int]]:
         """find all the intervals of words that have an unexpected symbol in them (letters belonging to the foreign alphabet)"""
 
-        # Create a set of allowed characters from the vocabulary
-        allowed_chars = set(self.origin_alphabet)
-
-        # Create a regex pattern to match any character that is not in the allowed_chars
-        pattern = r'[^' + re.escape(''.join(allowed_chars)) + r'\s\W\d]+'
-
-        # Find all matches in the text
-        matches = re.finditer(pattern, text)
-
-        return [(m.start(), m.end()) for m in matches]
+        return [(m.start(), m.end()) for m in self.foreign_letters_pattern.finditer(text)]
 
     def is_number(self, text):
         try:
@@ -126,7 +482,9 @@ class CodeSwitchingNERMetric:
     def is_proper_name(self, substring_start: int, substing_end: int,
                        ner_preds: List[Dict[str, Union[int, str]]],
                        offset=0, text="") -> bool:
-        """Check if the provided interval intersect with any of the extracted entities"""
+        """Check if the provided interval intersect with any of the extracted entities.
+        Deprecated, analyze_document checks the tokens of the whole batch against an IntervalIndex"""
+        warn_per_text_method("is_proper_name")
         for pred in ner_preds:
             if self.is_intersection(
                     start_1=substring_start, end_1=substing_end,
@@ -141,24 +499,33 @@ class CodeSwitchingNERMetric:
         return not (end_1 < start_2 or start_1 > end_2)
 
 
+    def find_broken_sentences(self, broken_tokens_dicts, sentences_ranges) -> List[int]:
+        """indices of the sentences that intersect with any of the broken tokens.
+        Deprecated, analyze_document finds the broken sentences of the whole batch"""
+        warn_per_text_method("find_broken_sentences")
+        broken_tokens_index = IntervalIndex(
+            [(broken_token_dict["start"], broken_token_dict["end"]) for broken_token_dict in broken_tokens_dicts]
+        )
+
+        return [
+            i for i, sentence_range_idx_dict in enumerate(sentences_ranges)
+            if broken_tokens_index.intersects(
+                start=sentence_range_idx_dict["start"],
+                end=sentence_range_idx_dict["end"]
+            )
+        ]
+
     def calc_sentences_num_broken(self, broken_tokens_dicts, sentences_ranges) -> int:
-        """calculate number of broken sentences"""
-        num_broken_sentences = 0
-        for sentence_range_idx_dict in sentences_ranges:
-            for broken_token_dict in broken_tokens_dicts:
-                if self.is_intersection(
-                        start_1=sentence_range_idx_dict["start"],
-                        end_1=sentence_range_idx_dict["end"],
-                        start_2=broken_token_dict["start"],
-                        end_2=broken_token_dict["end"],
-                ):
-                    num_broken_sentences += 1
-                    break
-
-        return num_broken_sentences
+        """calculate number of broken sentences.
+        Deprecated, analyze_document finds the broken sentences of the whole batch"""
+        warn_per_text_method("calc_sentences_num_broken")
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", DeprecationWarning)
+            return len(self.find_broken_sentences(broken_tokens_dicts=broken_tokens_dicts, sentences_ranges=sentences_ranges))
 
     def check_token_sentence_lang(self, substring_start, substing_end, sents_correct_langs, sentences_ranges):
-
+        """deprecated, analyze_document finds the sentences of the tokens of the whole batch"""
+        warn_per_text_method("check_token_sentence_lang")
         for i, sent_range_dict in enumerate(sentences_ranges):
             if substring_start >= sent_range_dict["start"] and substing_end <= sent_range_dict["end"]:
                 return sents_correct_langs[i]
@@ -169,101 +536,193 @@ class CodeSwitchingNERMetric:
     def calc_token_level_num_broken(self, tokens: List[Dict[str, Union[str, int]]],
                                     merged_ner_preds, sents_correct_langs,
                                     sentences_ranges) -> Tuple[int, Dict[str, Any]]:
+        """deprecated, the per-text token check; analyze_document checks the tokens of the whole batch"""
+        warn_per_text_method("calc_token_level_num_broken")
         num_broken = 0
         broken_tokens = []
 
-        all_ner_preds = sum(merged_ner_preds, [])
+        # same checks as check_token_sentence_lang and is_proper_name, with the sentences and the predictions indexed once
+        sentences_index = IntervalIndex([(sent_range["start"], sent_range["end"]) for sent_range in sentences_ranges])
+        ner_preds_index = IntervalIndex([(pred["start"], pred["end"]) for preds in merged_ner_preds for pred in preds])
+
+        tokens_have_foreign_letters = self.has_foreign_letters([token_dict["text"] for token_dict in tokens])
 
-        for token_dict in tokens:
+        for token_dict, token_has_foreign_letters in zip(tokens, tokens_have_foreign_letters):
+            token_sentences_idxs = sentences_index.containing(start=token_dict["start"], end=token_dict["end"])
 
-            if not self.check_token_sentence_lang(
-                    substring_start=token_dict["start"],
-                    substing_end=token_dict["end"],
-                    sents_correct_langs=sents_correct_langs,
-                    sentences_ranges=sentences_ranges):
+            if not token_sentences_idxs or not sents_correct_langs[token_sentences_idxs[0]]:
                 num_broken += 1
                 broken_tokens.append(token_dict)
 
             else:
-                if self.find_non_vocab_words_starts(token_dict["text"]):
-                    if not self.is_proper_name(
-                                        substring_start=token_dict["start"],
-                                        substing_end=token_dict["end"],
-                                        ner_preds=all_ner_preds
-                                ):
+                if token_has_foreign_letters:
+                    if not ner_preds_index.intersects(start=token_dict["start"], end=token_dict["end"]):
                         num_broken += 1
                         broken_tokens.append(token_dict)
 
         return num_broken, broken_tokens
 
 
-    def calculate(self, texts: List[str]) -> Dict[str, Union[str, float]]:
-        """metric calculation for a list of texts"""
-
-        total_num_sentences, total_num_tokens, total_num_tokens = 0, 0, 0
-        num_broken_sentences, num_broken_texts, num_broken_tokens = 0, 0, 0
-        total_num_texts = len(texts)
-
-        for raw_text in texts:
-            text = Preprocessor.preprocess(text=raw_text)
-
-            if text:
-                sentence_ner_preds, sentences, sentences_ranges, tokens_dicts = self.get_all_ner_preds_sentences(text=text)
-                merged_ner_preds = [
-                    self.merge_preds(
-                        text=text,
-                        preds=sentence_ner_preds[i]
-                    ) for i in range(len(sentence_ner_preds))
-                ]
-
-                sents_correct_langs = [
-                    self.is_sent_in_required_lang_ner(
-                        sent_text=sentences[i],
-                        sent_range_dict=sentences_ranges[i],
-                        sent_ner_preds=preds
-                    ) for i, preds in enumerate(merged_ner_preds)
-                ]
-
-                merged_ner_preds = [
-                    preds if is_sent_correct_lang else []
-                    for preds, is_sent_correct_lang in zip(merged_ner_preds, sents_correct_langs)
-                ]
-
-
-
-                total_num_sentences += len(sentences)
-
-                # calculate number of broken tokens
-                text_num_broken_words, broken_tokens_dicts = self.calc_token_level_num_broken(
-                    tokens=tokens_dicts,
-                    merged_ner_preds=merged_ner_preds,
-                    sents_correct_langs=sents_correct_langs,
-                    sentences_ranges=sentences_ranges
+    def analyze_text(self, text: str,
+                     sentence_ner_preds: List[List[Dict[str, Union[int, str]]]],
+                     sentences: List[str],
+                     sentences_ranges: List[Dict[str, int]],
+                     tokens_dicts: List[Dict[str, Union[str, int]]]) -> Dict[str, Any]:
+        """per-text analysis: sentences, tokens, merged predictions, broken tokens and broken sentences indices, and the
+        number of the truncated chars"""
+        document = Document(texts=[text], texts_sents=[(sentence_ner_preds, sentences, sentences_ranges, tokens_dicts)])
+
+        return self.analyze_document(document=document, spans=SpanList())[0]
+
+    def analyze_document(self, document: Document, spans: SpanList) -> List[Dict[str, Any]]:
+        """analyze_text for every text of the document, with the predictions of the sentence splitter and the spans.
+        The checks run on the whole batch at once, the results are split by the texts"""
+        instrumentation = self.instrumentation
+
+        with stage(instrumentation, "merge"):
+            sentences_intervals = [[] for _ in document.sentences]
+            self.add_spans_intervals(sentences_intervals=sentences_intervals, spans=document.sentence_ner_spans)
+            self.add_spans_intervals(sentences_intervals=sentences_intervals, spans=spans)
+            merged_intervals = [self.mergeIntervals(intervals=intervals) for intervals in sentences_intervals]
+
+        with stage(instrumentation, "sentences_lang"):
+            sents_correct_langs = [
+                self.is_sentence_correct(sentence=sentence, sentence_start=sentence_start, intervals=intervals)
+                for sentence, sentence_start, intervals in zip(
+                    document.sentences, document.sentences_starts, merged_intervals
                 )
-
-                if text_num_broken_words:
-                    num_broken_texts += 1
-
-                text_num_broken_sentences = self.calc_sentences_num_broken(
-                    broken_tokens_dicts=broken_tokens_dicts,
-                    sentences_ranges=sentences_ranges
+            ]
+
+        # same checks as calc_token_level_num_broken and find_broken_sentences
+        with stage(instrumentation, "broken_tokens"):
+            ner_preds_index = IntervalIndex([
+                (start, end)
+                for intervals, is_sent_correct_lang in zip(merged_intervals, sents_correct_langs) if is_sent_correct_lang
+                for start, end in intervals
+            ])
+            broken_tokens_idxs = [
+                k for k, (token_start, token_end, token_sentence_idx, token_has_foreign_letters) in enumerate(zip(
+                    document.tokens_starts,
+                    document.tokens_ends,
+                    document.tokens_sentences_idxs,
+                    self.tokens_have_foreign_letters(document)
+                ))
+                if token_sentence_idx == -1 or not sents_correct_langs[token_sentence_idx] or (
+                    token_has_foreign_letters and not ner_preds_index.intersects(start=token_start, end=token_end)
                 )
+            ]
 
-                num_broken_tokens += text_num_broken_words
-                total_num_tokens += len(tokens_dicts)
-                num_broken_sentences += text_num_broken_sentences
-
-
-
-        output = {
-            "codeswitch_sentences_ratio": num_broken_sentences/total_num_sentences if total_num_sentences else -1.0,
-            "codeswitch_texts_ratio": num_broken_texts/total_num_texts if total_num_texts else -1.0,
-            "total_num_texts": total_num_texts,
-            "total_num_sentences": total_num_sentences,
-            "codeswitch_words_ratio": num_broken_tokens/total_num_tokens if total_num_tokens else -1.0,
-            "total_num_tokens": total_num_tokens
-        }
-        return output
+        with stage(instrumentation, "broken_sentences"):
+            broken_tokens_index = IntervalIndex(
+                [(document.tokens_starts[k], document.tokens_ends[k]) for k in broken_tokens_idxs]
+            )
+            broken_sentences_idxs = [
+                i for i, (sentence_start, sentence_end) in enumerate(zip(document.sentences_starts, document.sentences_ends))
+                if broken_tokens_index.intersects(start=sentence_start, end=sentence_end)
+            ]
+
+        results = []
+        for t, (text, (_, sentences, sentences_ranges, tokens_dicts), offset) in enumerate(zip(
+                document.texts, document.texts_sents, document.texts_offsets
+        )):
+            first_sentence_idx, end_sentence_idx = document.texts_first_sentences[t], document.texts_first_sentences[t + 1]
+            first_token_idx, end_token_idx = document.texts_first_tokens[t], document.texts_first_tokens[t + 1]
+
+            merged_ner_preds = [
+                [
+                    {
+                        "start": start - offset,
+                        "end": end - offset,
+                        "text": text[start - offset: end - offset],
+                    } for start, end in merged_intervals[i]
+                ] if sents_correct_langs[i] else []
+                for i in range(first_sentence_idx, end_sentence_idx)
+            ]
+            broken_tokens_dicts = [
+                document.tokens_dicts[k] for k in broken_tokens_idxs[
+                    bisect.bisect_left(broken_tokens_idxs, first_token_idx): bisect.bisect_left(broken_tokens_idxs, end_token_idx)
+                ]
+            ]
+            broken_sentences = [
+                i - first_sentence_idx for i in broken_sentences_idxs[
+                    bisect.bisect_left(broken_sentences_idxs, first_sentence_idx): bisect.bisect_left(broken_sentences_idxs, end_sentence_idx)
+                ]
+            ]
+
+            results.append({
+                "sentences": sentences,
+                "sentences_ranges": sentences_ranges,
+                "tokens": tokens_dicts,
+                "merged_ner_preds": merged_ner_preds,
+                "num_broken_tokens": len(broken_tokens_dicts),
+                "broken_tokens": broken_tokens_dicts,
+                "broken_sentences": broken_sentences,
+                "num_broken_sentences": len(broken_sentences),
+                # chars in the end of the text that the sentence splitter did not analyze (see BaseNER.truncated_length)
+                "num_truncated_chars": len(text) - self.sentence_ner.truncated_length(text)
+            })
+
+        return results
+
+    def analyze_texts(self, texts: List[str]) -> List[Dict[str, Any]]:
+        """analyze_text for a batch of preprocessed texts. Results of the texts found in self.result_cache are taken
+        from it, the rest of the texts are passed through the sentence splitter and the NER modules together"""
+        results = [None for _ in texts]
+
+        keys = []
+        if self.result_cache is not None:
+            fingerprint = self.fingerprint()
+            keys = [self.result_cache.make_key(fingerprint=fingerprint, text=text) for text in texts]
+            results = [self.result_cache.get(key) for key in keys]
+
+        missing_idxs = [i for i, result in enumerate(results) if result is None]
+        document = self.build_document(texts=[texts[i] for i in missing_idxs])
+        missing_results = self.analyze_document(document=document, spans=self.predict_document_spans(document=document))
+
+        for i, result in zip(missing_idxs, missing_results):
+            results[i] = result
+        if self.result_cache is not None:
+            self.result_cache.put_many(keys=[keys[i] for i in missing_idxs], results=missing_results)
+
+        if self.instrumentation is not None:
+            self.instrumentation.count("texts", len(results))
+            self.instrumentation.count("sentences", sum(len(result["sentences"]) for result in results))
+            self.instrumentation.count("tokens", sum(len(result["tokens"]) for result in results))
+
+        return results
+
+    def calculate(self, texts: List[str], batch_size: int = 1) -> Dict[str, Union[str, float]]:
+        """metric calculation for a list of texts.
+
+        batch_size: int, number of texts that are split into sentences and passed through the NER modules together.
+            Larger batches save the per-call overhead of the models, the report is the same for any batch size
+        """
+        accumulator = MetricAccumulator(metric=self)
+        accumulator.update(texts=texts, batch_size=batch_size)
+
+        return accumulator.report()
+
+    def accumulate_stream(self, texts: Iterable[str], chunk_size: int = 1024, batch_size: int = 32,
+                          keep_texts: bool = False) -> Iterator[MetricAccumulator]:
+        """read texts from any iterable by chunks of chunk_size and yield the MetricAccumulator of every chunk.
+        Only one chunk is held in memory at a time"""
+        texts = iter(texts)
+        while True:
+            chunk = list(itertools.islice(texts, chunk_size))
+            if not chunk:
+                return
+
+            accumulator = MetricAccumulator(metric=self, keep_texts=keep_texts)
+            accumulator.update(texts=chunk, batch_size=batch_size)
+            yield accumulator
+
+    def calculate_stream(self, texts: Iterable[str], chunk_size: int = 1024,
+                         batch_size: int = 32) -> Iterator[Dict[str, Union[str, float]]]:
+        """streaming version of calculate: yields the report of all the texts read so far after every chunk,
+        the last yielded report is the report of all the texts"""
+        accumulator = MetricAccumulator(metric=self)
+        for chunk_accumulator in self.accumulate_stream(texts=texts, chunk_size=chunk_size, batch_size=batch_size):
+            yield accumulator.merge(chunk_accumulator).report()
 
 if __name__ == '__main__':
     from loaders import load_metric
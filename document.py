@@ -0,0 +1,191 @@
+from intervals import IntervalIndex
+from array import array
+import bisect
+import sys
+
+from typing import List, Dict, Union, Tuple
+
+
+class SpanList:
+    """Predictions of a batch as parallel arrays: the index of the sentence (in the Document), the start and the end
+    (in the shared offsets of the Document) and the label. Labels are interned, so equal labels share one string"""
+    __slots__ = ("sentences_idxs", "starts", "ends", "labels")
+
+    def __init__(self):
+        self.sentences_idxs = array("q")
+        self.starts = array("q")
+        self.ends = array("q")
+        self.labels = []
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def append(self, sentence_idx: int, start: int, end: int, label: str):
+        self.sentences_idxs.append(sentence_idx)
+        self.starts.append(start)
+        self.ends.append(end)
+        self.labels.append(label)
+
+    def extend(self, other: "SpanList") -> "SpanList":
+        self.sentences_idxs.extend(other.sentences_idxs)
+        self.starts.extend(other.starts)
+        self.ends.extend(other.ends)
+        self.labels += other.labels
+        return self
+
+    def extend_dicts(self, sentences_idxs: List[int], preds: List[List[Dict[str, Union[int, str]]]], offset: int = 0):
+        """add the predictions of the dict API of BaseNER: preds[i] are the predictions of the sentence
+        sentences_idxs[i], offset is added to their starts and ends"""
+        for sentence_idx, sentence_preds in zip(sentences_idxs, preds):
+            for pred in sentence_preds:
+                label = pred.get("label", "")
+                self.append(
+                    sentence_idx=sentence_idx,
+                    start=pred["start"] + offset,
+                    end=pred["end"] + offset,
+                    label=sys.intern(label) if isinstance(label, str) else label
+                )
+
+    def intervals(self) -> List[Tuple[int, int]]:
+        return list(zip(self.starts, self.ends))
+
+
+class Document:
+    """Sentences and tokens of a batch of texts split by the sentence splitter, in one shared offsets space: every
+    text starts after the end of the previous one (+1, so that the inclusive ends of one text never touch the next one).
+    The offsets are kept in arrays instead of a dict per sentence and token, the NER modules exchange their predictions
+    for it as SpanList (see BaseNER.predict_spans)"""
+    __slots__ = (
+        "texts", "texts_sents", "texts_offsets", "texts_first_sentences", "texts_first_tokens",
+        "sentences", "lowercased_sentences", "sentences_starts", "sentences_ends", "sentences_disjoint",
+        "tokens_dicts", "tokens_texts", "tokens_starts", "tokens_ends", "tokens_sentences_idxs",
+        "tokens_have_foreign_letters", "sentence_ner_spans", "last_tokens_dicts"
+    )
+
+    def __init__(self, texts: List[str], texts_sents: List[Tuple[
+        List[List[Dict[str, Union[int, str]]]],
+        List[str],
+        List[Dict[str, int]],
+        List[Dict[str, Union[str, int]]]
+    ]]):
+        """
+        texts: list of str, the texts of the batch
+        texts_sents: output of the sentence splitter (BaseNER.pred_ner_sents_batch) for the texts:
+            (predictions, sentences, sentences ranges, tokens) of every text
+        """
+        self.texts = texts
+        self.texts_sents = texts_sents
+        self.texts_offsets = []
+        # index of the first sentence / token of every text, and the total number in the end
+        self.texts_first_sentences = []
+        self.texts_first_tokens = []
+
+        self.sentences = []
+        self.sentences_starts = array("q")
+        self.sentences_ends = array("q")
+        # the original token dicts of the splitter (in the offsets of their texts)
+        self.tokens_dicts = []
+        self.tokens_texts = []
+        self.tokens_starts = array("q")
+        self.tokens_ends = array("q")
+        self.sentence_ner_spans = SpanList()
+        # set by the metric
+        self.tokens_have_foreign_letters = None
+        # (sentences indices, token dicts) of the last tokens_dicts_of_sentences call, the modules of one cascade tier
+        # ask for the same sentences
+        self.last_tokens_dicts = None
+
+        offset = 0
+        for text, (ner_preds, sentences, sentences_ranges, tokens_dicts) in zip(texts, texts_sents):
+            self.texts_offsets.append(offset)
+            self.texts_first_sentences.append(len(self.sentences))
+            self.texts_first_tokens.append(len(self.tokens_dicts))
+
+            self.sentence_ner_spans.extend_dicts(
+                sentences_idxs=range(len(self.sentences), len(self.sentences) + len(ner_preds)),
+                preds=ner_preds,
+                offset=offset
+            )
+            self.sentences += sentences
+            self.sentences_starts.extend(sent_range["start"] + offset for sent_range in sentences_ranges)
+            self.sentences_ends.extend(sent_range["end"] + offset for sent_range in sentences_ranges)
+            self.tokens_dicts += tokens_dicts
+            self.tokens_texts += [token_dict["text"] for token_dict in tokens_dicts]
+            self.tokens_starts.extend(token_dict["start"] + offset for token_dict in tokens_dicts)
+            self.tokens_ends.extend(token_dict["end"] + offset for token_dict in tokens_dicts)
+
+            offset += len(text) + 1
+
+        self.texts_first_sentences.append(len(self.sentences))
+        self.texts_first_tokens.append(len(self.tokens_dicts))
+
+        # lowercased once for all the case-insensitive finders
+        self.lowercased_sentences = [sentence.lower() for sentence in self.sentences]
+
+        # sentences go one after another without touching, as from the usual splitters: every token is then in one
+        # sentence at most, found by a binary search
+        starts, ends = self.sentences_starts, self.sentences_ends
+        self.sentences_disjoint = all(starts[i] <= ends[i] for i in range(len(starts))) and all(
+            starts[i] > ends[i - 1] for i in range(1, len(starts))
+        )
+        self.tokens_sentences_idxs = self.find_tokens_sentences()
+
+    def find_tokens_sentences(self) -> array:
+        """index of the first sentence that contains every token, -1 for the tokens outside of the sentences"""
+        tokens_sentences_idxs = array("q")
+        starts, ends = self.sentences_starts, self.sentences_ends
+
+        if self.sentences_disjoint:
+            for token_start, token_end in zip(self.tokens_starts, self.tokens_ends):
+                j = bisect.bisect_right(starts, token_start) - 1
+                tokens_sentences_idxs.append(j if j >= 0 and ends[j] >= token_end else -1)
+        else:
+            sentences_index = IntervalIndex(list(zip(starts, ends)))
+            for token_start, token_end in zip(self.tokens_starts, self.tokens_ends):
+                sentence_idx = sentences_index.first_containing(start=token_start, end=token_end)
+                tokens_sentences_idxs.append(-1 if sentence_idx is None else sentence_idx)
+
+        return tokens_sentences_idxs
+
+    def sentences_groups(self) -> List[int]:
+        """group index of every sentence: sentences whose ranges overlap or touch (the ends are inclusive) are in one
+        group. The predictions of a sentence can only cover the tokens of its own group"""
+        if self.sentences_disjoint:
+            return list(range(len(self.sentences)))
+
+        groups = [0] * len(self.sentences)
+        group, group_end = -1, None
+        for i in sorted(range(len(self.sentences)), key=lambda i: self.sentences_starts[i]):
+            if group_end is None or self.sentences_starts[i] > group_end:
+                group += 1
+                group_end = self.sentences_ends[i]
+            else:
+                group_end = max(group_end, self.sentences_ends[i])
+            groups[i] = group
+
+        return groups
+
+    def sentences_ranges(self, sentences_idxs: List[int]) -> List[Dict[str, int]]:
+        """ranges of the sentences as in the dict API of BaseNER, in the shared offsets"""
+        return [{"start": self.sentences_starts[i], "end": self.sentences_ends[i]} for i in sentences_idxs]
+
+    def tokens_dicts_of_sentences(self, sentences_idxs: List[int]) -> List[Dict[str, Union[str, int]]]:
+        """token dicts (in the shared offsets) of the sentences, as in the dict API of BaseNER"""
+        if self.last_tokens_dicts is not None and self.last_tokens_dicts[0] == sentences_idxs:
+            return self.last_tokens_dicts[1]
+
+        tokens_idxs = range(len(self.tokens_dicts))
+        if len(sentences_idxs) < len(self.sentences):
+            sentences_idxs_set = set(sentences_idxs)
+            if self.sentences_disjoint:
+                tokens_idxs = [k for k in tokens_idxs if self.tokens_sentences_idxs[k] in sentences_idxs_set]
+            else:
+                # a token can be in several sentences, the modules find them by the ranges
+                tokens_idxs = [k for k in tokens_idxs if self.tokens_sentences_idxs[k] != -1]
+
+        tokens_dicts = [
+            dict(self.tokens_dicts[k], start=self.tokens_starts[k], end=self.tokens_ends[k]) for k in tokens_idxs
+        ]
+        self.last_tokens_dicts = (list(sentences_idxs), tokens_dicts)
+
+        return tokens_dicts
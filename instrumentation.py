@@ -0,0 +1,173 @@
+import bisect
+import os
+import threading
+import time
+
+from typing import Dict, Tuple, Optional
+
+
+def ner_module_name(idx: int, ner_module) -> str:
+    """name of the NER module in the timings: its index in the ner_modules, class and label"""
+    labelname = getattr(ner_module, "labelname", None)
+    return f"ner[{idx}]:{type(ner_module).__name__}" + (f":{labelname}" if labelname else "")
+
+
+def escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label_value(str(value))}"' for name, value in labels) + "}"
+
+
+def process_memory(pid: Optional[int] = None) -> Dict[str, int]:
+    """resident memory of the process in bytes, from /proc/<pid>/smaps_rollup (Linux):
+    rss, pss (the shared pages divided by the number of processes sharing them), shared and private.
+    Empty if it is not available"""
+    fields = {"Rss": "rss", "Pss": "pss", "Shared_Clean": "shared", "Shared_Dirty": "shared",
+              "Private_Clean": "private", "Private_Dirty": "private"}
+    memory = {}
+    try:
+        with open(f"/proc/{pid or os.getpid()}/smaps_rollup", "r") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if name in fields:
+                    memory[fields[name]] = memory.get(fields[name], 0) + int(value.split()[0]) * 1024
+    except OSError:
+        return {}
+
+    return memory
+
+
+class _NullStage:
+    """stage context manager of the disabled instrumentation"""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    def __init__(self, instrumentation: "Instrumentation", name: str):
+        self.instrumentation = instrumentation
+        self.name = name
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.instrumentation.observe(stage=self.name, seconds=time.perf_counter() - self.start_time)
+        return False
+
+
+class Instrumentation:
+    """Latency histograms of the metric stages, counters of the processed texts / sentences / tokens and of the
+    predictions of every NER module, rendered in the Prometheus text format.
+
+    CodeSwitchingNERMetric records into it when passed as its instrumentation, without it the stages are not timed"""
+
+    LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    COUNTERS = {
+        "texts": "Texts analyzed by the metric",
+        "sentences": "Sentences analyzed by the metric",
+        "tokens": "Tokens analyzed by the metric",
+        "predictions": "Predictions of the NER modules",
+        "ner_sentences": "Sentences the NER modules were run on",
+        "ner_skipped_sentences": "Sentences without foreign letters that the NER modules were not run on",
+        "ner_hits": "Foreign-letter tokens that the NER module covered first in the cascade",
+        "ner_deduplicated_sentences": "Sentences the NER module did not run on, as an identical sentence of the batch was run",
+    }
+
+    def __init__(self, namespace: str = "pnacos", buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        """
+        namespace: str, prefix of the exported metric names
+        buckets: tuple of float, upper bounds of the latency histogram buckets, in seconds
+        """
+        self.namespace = namespace
+        self.buckets = tuple(sorted(buckets))
+        self.lock = threading.Lock()
+
+        # stage: [bucket counts (the last one is +Inf), sum, count]
+        self.histograms = {}
+        # (counter, labels): value
+        self.counters = {}
+        # (gauge, labels): (value, help)
+        self.gauges = {}
+
+    def stage(self, name: str) -> _Stage:
+        """context manager that records the time of its block as the stage"""
+        return _Stage(instrumentation=self, name=name)
+
+    def observe(self, stage: str, seconds: float):
+        bucket_idx = bisect.bisect_left(self.buckets, seconds)
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            histogram[0][bucket_idx] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+
+    def count(self, counter: str, value: int = 1, **labels):
+        """add to one of the COUNTERS"""
+        key = (counter, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, gauge: str, value: float, help: str = "", **labels):
+        with self.lock:
+            self.gauges[(gauge, tuple(sorted(labels.items())))] = (value, help)
+
+    def render(self, **labels) -> str:
+        """all the metrics in the Prometheus text exposition format, labels are added to every series (e.g. the pid of
+        the worker process, when several workers record separately)"""
+        common_labels = tuple(sorted(labels.items()))
+        lines = []
+        with self.lock:
+            name = f"{self.namespace}_stage_seconds"
+            lines += [f"# HELP {name} Latency of the metric stages", f"# TYPE {name} histogram"]
+            for stage, (bucket_counts, seconds_sum, num_observations) in sorted(self.histograms.items()):
+                cumulative_count = 0
+                for upper_bound, bucket_count in zip(self.buckets + (float("inf"),), bucket_counts):
+                    cumulative_count += bucket_count
+                    bound = "+Inf" if upper_bound == float("inf") else repr(upper_bound)
+                    lines.append(f"{name}_bucket{format_labels(common_labels + (('stage', stage), ('le', bound)))} {cumulative_count}")
+                lines.append(f"{name}_sum{format_labels(common_labels + (('stage', stage),))} {seconds_sum!r}")
+                lines.append(f"{name}_count{format_labels(common_labels + (('stage', stage),))} {num_observations}")
+
+            for counter, help in self.COUNTERS.items():
+                name = f"{self.namespace}_{counter}_total"
+                lines += [f"# HELP {name} {help}", f"# TYPE {name} counter"]
+                for (key_counter, counter_labels), value in sorted(self.counters.items()):
+                    if key_counter == counter:
+                        lines.append(f"{name}{format_labels(common_labels + counter_labels)} {value}")
+
+            gauges_help = {}
+            for (gauge, gauge_labels), (value, help) in sorted(self.gauges.items()):
+                name = f"{self.namespace}_{gauge}"
+                if gauge not in gauges_help:
+                    gauges_help[gauge] = help
+                    lines += [f"# HELP {name} {help}", f"# TYPE {name} gauge"]
+                lines.append(f"{name}{format_labels(common_labels + gauge_labels)} {value!r}")
+
+        return "\n".join(lines) + "\n"
+
+    def stages_seconds(self) -> Dict[str, float]:
+        """total seconds of every stage"""
+        with self.lock:
+            return {stage: histogram[1] for stage, histogram in self.histograms.items()}
+
+
+def stage(instrumentation: Optional[Instrumentation], name: str):
+    """instrumentation.stage(name), or a no-op context manager if the instrumentation is None"""
+    if instrumentation is None:
+        return NULL_STAGE
+    return instrumentation.stage(name)
@@ -0,0 +1,43 @@
+import bisect
+import itertools
+
+from typing import List, Tuple, Optional
+
+
+class IntervalIndex:
+    """Static index over closed intervals [start, end]: the ends are inclusive, as in
+    CodeSwitchingNERMetric.is_intersection. The intervals are sorted by start once, together with the running max of
+    their ends, so every query is a binary search plus a walk over the candidates only"""
+
+    def __init__(self, intervals: List[Tuple[int, int]]):
+        self.intervals = intervals
+        self.order = sorted(range(len(intervals)), key=lambda i: intervals[i][0])
+        self.starts = [intervals[i][0] for i in self.order]
+        self.max_ends = list(itertools.accumulate((intervals[i][1] for i in self.order), max))
+
+    def intersects(self, start: int, end: int) -> bool:
+        """whether any interval intersects [start, end], i.e. not (end < interval_start or start > interval_end)"""
+        j = bisect.bisect_right(self.starts, end) - 1
+        return j >= 0 and self.max_ends[j] >= start
+
+    def containing(self, start: int, end: int) -> List[int]:
+        """indices (in the original order) of the intervals that contain [start, end]"""
+        idxs = []
+        j = bisect.bisect_right(self.starts, start) - 1
+        while j >= 0 and self.max_ends[j] >= end:
+            if self.intervals[self.order[j]][1] >= end:
+                idxs.append(self.order[j])
+            j -= 1
+
+        return sorted(idxs)
+
+    def first_containing(self, start: int, end: int) -> Optional[int]:
+        """the smallest index (in the original order) of the intervals that contain [start, end], None if there is none"""
+        first_idx = None
+        j = bisect.bisect_right(self.starts, start) - 1
+        while j >= 0 and self.max_ends[j] >= end:
+            if self.intervals[self.order[j]][1] >= end and (first_idx is None or self.order[j] < first_idx):
+                first_idx = self.order[j]
+            j -= 1
+
+        return first_idx
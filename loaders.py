@@ -1,10 +1,35 @@
 from ner_utils import *
 from code_switching_ner_metric import CodeSwitchingNERMetric
-import json
+from result_cache import ResultCache
+from instrumentation import Instrumentation
+from rule_artifacts import load_rule_modules, DEFAULT_ARTIFACTS_DIR
+from concurrent.futures import ThreadPoolExecutor
+import time
 
+from typing import Optional, Dict
 
+ORIGIN_ALPHABET = "АаБбВвГгҐґДдЕеЄєЖжЗзИиІіЇїЙйКкЛлМмНнОоПпСсТтРрУуХхФфЦцЧчШшЩщьЬЮюЯя"
 
-def load_metric() -> CodeSwitchingNERMetric:
+
+def import_model_libraries():
+    """import the libraries of the models in the calling thread. The model constructors import them too, and heavy
+    packages with shared dependencies imported from several threads at once can hit the import locks deadlock detection
+    or see half-initialized modules"""
+    import torch
+    from transformers import AutoTokenizer, AutoModelForTokenClassification, pipeline
+    import spacy
+    import stanza
+
+
+def load_metric(result_cache: Optional[ResultCache] = None,
+                parallel: bool = True,
+                warmup: bool = False,
+                timings: Optional[Dict[str, float]] = None,
+                rules_artifacts_dir: Optional[str] = DEFAULT_ARTIFACTS_DIR,
+                instrumentation: Optional[Instrumentation] = None,
+                cascade: bool = False,
+                max_document_chars: Optional[int] = None,
+                window_chars: Optional[int] = None) -> CodeSwitchingNERMetric:
 
     """
     consider_labels arguments in NER modules are considered to be list of str labels
@@ -14,113 +39,91 @@ def load_metric() -> CodeSwitchingNERMetric:
     ppl_lang: str, a language name/path for stanza to load
      origin_alphabet: str, alphabet that is considered to be native. Everything outside (letters only) will be treated as
      a candidate for a code switching
+    result_cache: ResultCache, optional cache of the per-text results, see result_cache.py
+    parallel: bool, load the models (transformers, spaCy, Stanza) concurrently, while the rules are being built
+    warmup: bool, run a text through the metric after loading, so the first request does not pay for lazy initializations
+    timings: dict, optional, filled with the loading time in seconds of the model libraries imports, of every model,
+        the rule-based modules, the warm-up and the total
+    rules_artifacts_dir: str, directory of the precompiled rule-based modules artifact, see rule_artifacts.py.
+        If None, the rules are built from the resource files
+    instrumentation: Instrumentation, optional per-stage latency and counts recording, see instrumentation.py
+    cascade: bool, run the rule-based modules first and the models only on the sentences they did not resolve,
+        see CodeSwitchingNERMetric
+    max_document_chars: int, optional, only the beginning of a longer text is analyzed, the truncated texts and chars
+        are in the report
+    window_chars: int, optional, texts longer than it are passed through stanza window by window, see StanzaNER.
+        If None, texts are passed whole
     """
+    timings = {} if timings is None else timings
+    start_time = time.perf_counter()
 
-    coding_names = open("coding_names.txt", "r").read().split("\n")
-    coding_names = [x.strip().lower() for x in coding_names if x.strip()]
-
-    fileformats = open("formats.txt", "r").read().split("\n")
-    fileformats = [x.lower() for x in fileformats if x]
-    fileformats = [x[1:] if x.startswith(".") else x for x in fileformats if x]
-    fileformats_extensions_pattern = "|".join([re.escape(ext) for ext in fileformats])
-    fileformats_regex_pattern = r'\b\w+\.(?:' + fileformats_extensions_pattern + r')\b'
-
-    def generate_web_domain_regex():
-        extensions = open("web_extentions.txt", "r").read().split("\n")
-        extensions = [x for x in extensions if x]
-
-        # Escape the dots in each extension and join them with `|` (OR operator)
-        escaped_extensions = [re.escape(ext) for ext in extensions]
-        regex_pattern = r'\b[\w.-]+(?:' + '|'.join(escaped_extensions) + r')\b'
-        return regex_pattern
-
-    latin_phrases_regex = "|".join(
-        [s.lower() for s in open("latin.txt", "r").read().split("\n") if s]
-    )
+    def timed(name, constructor):
+        module_start_time = time.perf_counter()
+        module = constructor()
+        timings[name] = time.perf_counter() - module_start_time
+        return module
 
-    ner_modules = [
-        TransformersNER(
+    models_constructors = {
+        "TransformersNER": lambda: TransformersNER(
             consider_labels=["MISC", "PER", "ORG", "LOC"],
-            modelname="EvanD/xlm-roberta-base-ukrainian-ner-ukrner"
+            modelname="EvanD/xlm-roberta-base-ukrainian-ner-ukrner",
+            backend="torch",
+            num_threads=None,
+            max_batch_tokens=8192,
+            max_length=512,
+            window_overlap=128
         ),
-        SpacyNER(
+        "SpacyNER": lambda: SpacyNER(
             consider_labels=[
                 "ORG", "PER", "MISC", "LOC", "PERSON",
                 "LOCATION", "GPE"
             ],
-            modelname="uk_core_news_lg"
-        ),
-        RegexFinder(
-            pattern=r"([\'\"\`])(.*)\1",
-            labelname="Quote"
-        ),
-        RegexFinder(
-            pattern='https?://(?:[-\w.]|(?:%[\da-fA-F]{2}))+',
-            labelname="URL"
-        ),
-        RegexFinder(
-            pattern=r'\b(?:M{0,4})(?:CM|CD|D?C{0,3})(?:XC|XL|L?X{0,3})(?:IX|IV|V?I{0,3})\b',
-            labelname='RomanInteger'
-        ),
-        # CorpusCommonTokensFinder(
-        #     comon_tokens_list=json.load(
-        #         open("ukr_corpus_words.json", "r")
-        #     )
-        # ),
-        CorpusCommonTokensFinder(
-            comon_tokens_list=json.load(
-                open("FDA-parsed-additives.json", "r")
-            )
-        ),
-        InclusionSymbols(
-            inclusion_symbols_list=[s.strip() for s in open("math_symbols.txt", "r").read().split("\n") if s]
-        ),
-        RegexFinder(
-            pattern=r'[⁰¹²³⁴⁵⁶⁷⁸⁹]',
-            labelname="MathPower"
+            modelname="uk_core_news_lg",
+            enable_components=["tok2vec", "ner"],
+            batch_size=256,
+            n_process=1
         ),
-        RegexFinder(
-            pattern="^#[\w]+",
-            labelname="Hashtag"
-        ),
-        RegexFinder(
-            pattern="|".join(coding_names),
-            labelname="Coding",
-            do_lowercase=True
-        ),
-        RegexFinder(
-            pattern=fileformats_regex_pattern,
-            labelname="FileName",
-            do_lowercase=True
-        ),
-        CorpusCommonTokensFinder(
-            comon_tokens_list=fileformats + [
-                "." + fileformat_name for fileformat_name in fileformats
-            ]
-        ),
-        RegexFinder(
-            pattern=generate_web_domain_regex(),
-            labelname="Website"
-        ),
-        RegexFinder(
-            pattern=latin_phrases_regex,
-            labelname="Latin",
-            do_lowercase=True
+        "StanzaNER": lambda: StanzaNER(
+            ppl_lang='uk',
+            consider_labels = [
+                "ORG", "PERS", "MISC", "LOC",
+                "PERSON", "PER", "JOB", "DOC", "ART"
+            ],
+            window_chars=window_chars,
+            max_document_chars=max_document_chars
         )
-    ]
-    sentence_ner = StanzaNER(
-        ppl_lang='uk',
-        consider_labels = [
-            "ORG", "PERS", "MISC", "LOC",
-            "PERSON", "PER", "JOB", "DOC", "ART"
-        ]
-    )
+    }
+    timed("imports", import_model_libraries)
+
+    # the models are loaded in background threads, the rule-based modules are built in the meantime
+    executor = ThreadPoolExecutor(max_workers=len(models_constructors) if parallel else 1)
+    models_futures = {
+        name: executor.submit(timed, name, constructor) for name, constructor in models_constructors.items()
+    }
+    rules_start_time = time.perf_counter()
+
+    rule_modules = load_rule_modules(artifacts_dir=rules_artifacts_dir)
+    timings["rule_modules"] = time.perf_counter() - rules_start_time
+
+    models = {name: future.result() for name, future in models_futures.items()}
+    executor.shutdown()
+
+    ner_modules = [models["TransformersNER"], models["SpacyNER"]] + rule_modules
+    sentence_ner = models["StanzaNER"]
 
     metric = CodeSwitchingNERMetric(
-        origin_alphabet="АаБбВвГгҐґДдЕеЄєЖжЗзИиІіЇїЙйКкЛлМмНнОоПпСсТтРрУуХхФфЦцЧчШшЩщьЬЮюЯя",
+        origin_alphabet=ORIGIN_ALPHABET,
         ner_modules=ner_modules,
-        sentence_ner=sentence_ner
+        sentence_ner=sentence_ner,
+        result_cache=result_cache,
+        instrumentation=instrumentation,
+        cascade=cascade
     )
 
+    if warmup:
+        timed("warmup", lambda: metric.calculate(texts=["Я живу в Kyiv. Applications are now open!"]))
+
+    timings["total"] = time.perf_counter() - start_time
+
     return metric
 
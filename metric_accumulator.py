@@ -0,0 +1,144 @@
+from preprocessing import Preprocessor
+
+from typing import List, Dict, Union, Any, Optional
+
+
+class MetricAccumulator:
+    """Raw counts of the metric, that can be updated with more texts, merged with the counts of other shards/workers
+    and turned into the report at any time.
+
+    If keep_texts, a compact record is also kept for every text, in the order of the texts:
+        {"num_sentences": int, "num_tokens": int,
+         "broken_tokens": [[start, end], ...], "broken_sentences": [sentence index, ...], "num_truncated_chars": int}
+    """
+
+    COUNTERS = [
+        "total_num_texts", "total_num_sentences", "total_num_tokens",
+        "num_broken_texts", "num_broken_sentences", "num_broken_tokens",
+        "num_truncated_texts", "num_truncated_chars",
+        "num_ner_split_sentences", "num_ner_skipped_sentences", "num_ner_module_sentences", "num_ner_module_run_sentences"
+    ]
+
+    def __init__(self, metric=None, keep_texts: bool = False):
+        """
+        metric: CodeSwitchingNERMetric, used by update. Not needed for accumulators that are only merged
+        keep_texts: bool, keep the per-text records
+        """
+        self.metric = metric
+        self.keep_texts = keep_texts
+
+        self.total_num_texts, self.total_num_sentences, self.total_num_tokens = 0, 0, 0
+        self.num_broken_texts, self.num_broken_sentences, self.num_broken_tokens = 0, 0, 0
+        # texts longer than the max document size of the sentence splitter, and their chars that were not analyzed
+        self.num_truncated_texts, self.num_truncated_chars = 0, 0
+        # sentences the NER modules were skipped for and the sentences deduplicated before them, see
+        # CodeSwitchingNERMetric.ner_run_counts. Texts found in the result cache add nothing to them
+        self.num_ner_split_sentences, self.num_ner_skipped_sentences = 0, 0
+        self.num_ner_module_sentences, self.num_ner_module_run_sentences = 0, 0
+        self.texts_records = []
+
+    def update(self, texts: List[str], batch_size: int = 1):
+        """preprocess and analyze the texts with self.metric and add them to the counts"""
+        for batch_start in range(0, len(texts), batch_size):
+            batch_texts = [
+                Preprocessor.preprocess(text=raw_text) for raw_text in texts[batch_start: batch_start + batch_size]
+            ]
+            ner_run_counts = self.metric.ner_run_counts()
+            texts_results = iter(self.metric.analyze_texts(texts=[text for text in batch_texts if text]))
+            self.add_ner_run_counts(before=ner_run_counts, after=self.metric.ner_run_counts())
+
+            for text in batch_texts:
+                self.add_text_result(text_result=next(texts_results) if text else None)
+
+    def add_ner_run_counts(self, before: Dict[str, int], after: Dict[str, int]):
+        """add the NER run counts of the metric between two CodeSwitchingNERMetric.ner_run_counts calls"""
+        for counter, value in after.items():
+            setattr(self, counter, getattr(self, counter) + value - before[counter])
+
+    def add_text_result(self, text_result: Optional[Dict[str, Any]]):
+        """add the result of CodeSwitchingNERMetric.analyze_text; None for an empty text"""
+        self.total_num_texts += 1
+
+        if text_result is None:
+            if self.keep_texts:
+                self.texts_records.append(
+                    {"num_sentences": 0, "num_tokens": 0, "broken_tokens": [], "broken_sentences": [], "num_truncated_chars": 0}
+                )
+            return
+
+        self.total_num_sentences += len(text_result["sentences"])
+        self.total_num_tokens += len(text_result["tokens"])
+        self.num_broken_tokens += text_result["num_broken_tokens"]
+        self.num_broken_sentences += text_result["num_broken_sentences"]
+        if text_result["num_broken_tokens"]:
+            self.num_broken_texts += 1
+        if text_result["num_truncated_chars"]:
+            self.num_truncated_texts += 1
+            self.num_truncated_chars += text_result["num_truncated_chars"]
+
+        if self.keep_texts:
+            self.texts_records.append(
+                {
+                    "num_sentences": len(text_result["sentences"]),
+                    "num_tokens": len(text_result["tokens"]),
+                    "broken_tokens": [
+                        [token_dict["start"], token_dict["end"]] for token_dict in text_result["broken_tokens"]
+                    ],
+                    "broken_sentences": text_result["broken_sentences"],
+                    "num_truncated_chars": text_result["num_truncated_chars"]
+                }
+            )
+
+    def merge(self, other: "MetricAccumulator") -> "MetricAccumulator":
+        """add the counts (and the records) of the other accumulator, as if its texts were appended to the texts of
+        this one. Both must keep the records or both not, see drop_texts"""
+        if self.keep_texts != other.keep_texts:
+            raise ValueError(
+                f"can not merge an accumulator with keep_texts={other.keep_texts} into one with keep_texts={self.keep_texts}"
+            )
+
+        for counter in self.COUNTERS:
+            setattr(self, counter, getattr(self, counter) + getattr(other, counter))
+        self.texts_records += other.texts_records
+
+        return self
+
+    def drop_texts(self) -> "MetricAccumulator":
+        """drop the per-text records (e.g. once they are written out), so the counts can be merged into an accumulator
+        that does not keep them"""
+        self.keep_texts = False
+        self.texts_records = []
+
+        return self
+
+    def report(self) -> Dict[str, Union[int, float]]:
+        return {
+            "codeswitch_sentences_ratio": self.num_broken_sentences/self.total_num_sentences if self.total_num_sentences else -1.0,
+            "codeswitch_texts_ratio": self.num_broken_texts/self.total_num_texts if self.total_num_texts else -1.0,
+            "total_num_texts": self.total_num_texts,
+            "total_num_sentences": self.total_num_sentences,
+            "codeswitch_words_ratio": self.num_broken_tokens/self.total_num_tokens if self.total_num_tokens else -1.0,
+            "total_num_tokens": self.total_num_tokens,
+            "num_truncated_texts": self.num_truncated_texts,
+            "num_truncated_chars": self.num_truncated_chars,
+            "ner_skip_rate": self.num_ner_skipped_sentences/self.num_ner_split_sentences if self.num_ner_split_sentences else 0.0,
+            "ner_dedup_ratio": 1 - self.num_ner_module_run_sentences/self.num_ner_module_sentences if self.num_ner_module_sentences else 0.0
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        """JSON-serializable state"""
+        state = {counter: getattr(self, counter) for counter in self.COUNTERS}
+        state["keep_texts"] = self.keep_texts
+        state["texts_records"] = self.texts_records
+
+        return state
+
+    @classmethod
+    def from_dict(cls, state: Dict[str, Any], metric=None) -> "MetricAccumulator":
+        accumulator = cls(metric=metric, keep_texts=state["keep_texts"])
+        for counter in cls.COUNTERS:
+            # states saved before the truncation and the NER run counters were added have none
+            setattr(accumulator, counter, state.get(counter, 0))
+        accumulator.texts_records = state["texts_records"]
+
+        return accumulator
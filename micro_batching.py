@@ -0,0 +1,150 @@
+from metric_accumulator import MetricAccumulator
+from preprocessing import Preprocessor
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+
+from typing import List, Dict, Union, Tuple
+
+
+class QueueFullError(Exception):
+    """raised when the queue of the MicroBatcher is over its limit, the request should be rejected"""
+
+
+class MicroBatcher:
+    """Collects the texts of concurrent requests and processes them together on a dedicated executor thread,
+    so the event loop is never blocked by the metric.
+
+    Requests that come within max_wait_ms after the first request of a batch (until the batch has max_batch_size
+    texts) are coalesced into one pass through the sentence splitter and the NER modules, every request then gets
+    the report of its own texts"""
+
+    def __init__(self, metric, max_batch_size: int = 256, max_wait_ms: float = 10, max_queue_size: int = 10000):
+        """
+        metric: CodeSwitchingNERMetric
+        max_batch_size: int, max number of texts in a batch (a single larger request makes a batch on its own)
+        max_wait_ms: float, how long to wait for more requests after the first request of a batch
+        max_queue_size: int, max number of texts waiting in the queue, the requests over it get QueueFullError
+            (a larger request is still accepted when nothing is waiting, it could never fit otherwise)
+        """
+        self.metric = metric
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.max_queue_size = max_queue_size
+
+        self.queue = None
+        self.task = None
+        self.num_queued_texts = 0
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="metric")
+
+    async def start(self):
+        self.queue = asyncio.Queue()
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        self.executor.shutdown(wait=False)
+
+    async def submit(self, texts: List[str]) -> Dict[str, Union[int, float]]:
+        """queue the texts of a request and wait for their report"""
+        accumulator = await self.submit_accumulate(texts=texts)
+        return accumulator.report()
+
+    async def submit_accumulate(self, texts: List[str], keep_texts: bool = False) -> MetricAccumulator:
+        """queue the texts of a request and wait for their MetricAccumulator (with per-text records if keep_texts)"""
+        if not texts:
+            return MetricAccumulator(keep_texts=keep_texts)
+
+        if self.num_queued_texts and self.num_queued_texts + len(texts) > self.max_queue_size:
+            raise QueueFullError(f"{self.num_queued_texts} texts are already waiting in the queue")
+
+        future = asyncio.get_running_loop().create_future()
+        self.num_queued_texts += len(texts)
+        self.queue.put_nowait((texts, keep_texts, future))
+
+        return await future
+
+    async def collect_batch(self) -> List[Tuple[List[str], bool, asyncio.Future]]:
+        loop = asyncio.get_running_loop()
+
+        batch = [await self.queue.get()]
+        num_texts = len(batch[0][0])
+        deadline = loop.time() + self.max_wait_ms / 1000
+
+        while num_texts < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                request = await asyncio.wait_for(self.queue.get(), timeout=timeout)
+            except asyncio.TimeoutError:
+                break
+            batch.append(request)
+            num_texts += len(request[0])
+
+        return batch
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self.collect_batch()
+            requests_texts = [texts for texts, _, _ in batch]
+            try:
+                accumulators = await loop.run_in_executor(
+                    self.executor, self.process, requests_texts, [keep_texts for _, keep_texts, _ in batch]
+                )
+                for (_, _, future), accumulator in zip(batch, accumulators):
+                    if not future.done():
+                        future.set_result(accumulator)
+            except Exception as e:
+                if len(batch) == 1:
+                    if not batch[0][2].done():
+                        batch[0][2].set_exception(e)
+                else:
+                    await self.process_separately(batch)
+            finally:
+                self.num_queued_texts -= sum(len(texts) for texts in requests_texts)
+
+    async def process_separately(self, batch: List[Tuple[List[str], bool, asyncio.Future]]):
+        """process the requests of a failed batch one by one, so that only the request with the failing text fails"""
+        loop = asyncio.get_running_loop()
+        for texts, keep_texts, future in batch:
+            if future.done():
+                continue
+            try:
+                accumulators = await loop.run_in_executor(self.executor, self.process, [texts], [keep_texts])
+                if not future.done():
+                    future.set_result(accumulators[0])
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+
+    def process(self, requests_texts: List[List[str]], requests_keep_texts: List[bool]) -> List[MetricAccumulator]:
+        """accumulators of several requests, with the texts of all of them analyzed together"""
+        requests_preprocessed_texts = [
+            [Preprocessor.preprocess(text=raw_text) for raw_text in texts] for texts in requests_texts
+        ]
+        all_texts = [text for texts in requests_preprocessed_texts for text in texts if text]
+
+        ner_run_counts = self.metric.ner_run_counts()
+        all_results = []
+        for batch_start in range(0, len(all_texts), self.max_batch_size):
+            all_results += self.metric.analyze_texts(texts=all_texts[batch_start: batch_start + self.max_batch_size])
+        all_results = iter(all_results)
+        batch_ner_run_counts = self.metric.ner_run_counts()
+
+        accumulators = []
+        for texts, keep_texts in zip(requests_preprocessed_texts, requests_keep_texts):
+            accumulator = MetricAccumulator(keep_texts=keep_texts)
+            # the sentences of the requests are skipped / deduplicated together, so every request gets the NER run
+            # counts of the whole batch: its ner_skip_rate and ner_dedup_ratio are the ones of the batch
+            accumulator.add_ner_run_counts(before=ner_run_counts, after=batch_ner_run_counts)
+            for text in texts:
+                accumulator.add_text_result(text_result=next(all_results) if text else None)
+            accumulators.append(accumulator)
+
+        return accumulators
@@ -0,0 +1,117 @@
+from metric_accumulator import MetricAccumulator
+import asyncio
+import json
+
+from typing import AsyncIterator, Optional, Tuple
+
+# max bytes of one character in a JSON string: a character out of the BMP escaped as a surrogate pair, \ud83d\ude00
+MAX_JSON_CHAR_BYTES = 12
+
+
+class RequestTooLargeError(Exception):
+    """raised when the streamed request body is over its size limit"""
+
+
+async def read_ndjson_lines(byte_chunks: AsyncIterator[bytes], max_request_bytes: int,
+                            max_line_bytes: int) -> AsyncIterator[Optional[bytes]]:
+    """split a streamed body into lines without holding more than one line in memory.
+    Yields None instead of a line longer than max_line_bytes, raises RequestTooLargeError after max_request_bytes"""
+    buffer = b""
+    num_bytes = 0
+    skipping_line = False
+
+    async for chunk in byte_chunks:
+        num_bytes += len(chunk)
+        if num_bytes > max_request_bytes:
+            raise RequestTooLargeError(f"request body is larger than {max_request_bytes} bytes")
+
+        lines = (buffer + chunk).split(b"\n")
+        buffer = lines.pop()
+        for line in lines:
+            if skipping_line:
+                skipping_line = False
+                yield None
+            elif line.strip():
+                yield line
+
+        if len(buffer) > max_line_bytes:
+            buffer = b""
+            skipping_line = True
+
+    if skipping_line:
+        yield None
+    elif buffer.strip():
+        yield buffer
+
+
+def parse_text_line(line: Optional[bytes], max_text_length: int) -> Tuple[Optional[str], Optional[str]]:
+    """(text, error) of an NDJSON line: either {"text": "..."} or a JSON string"""
+    if line is None:
+        return None, f"text is longer than {max_text_length} characters"
+
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return None, "line is not a valid JSON"
+
+    text = record.get("text") if isinstance(record, dict) else record
+    if not isinstance(text, str):
+        return None, "line should be a JSON string or an object with a \"text\" string field"
+    if len(text) > max_text_length:
+        return None, f"text is longer than {max_text_length} characters"
+
+    return text, None
+
+
+async def stream_text_results(batcher, byte_chunks: AsyncIterator[bytes], chunk_size: int,
+                              max_request_bytes: int, max_text_length: int) -> AsyncIterator[str]:
+    """read texts from a streamed NDJSON body, send them to the MicroBatcher by chunks of chunk_size texts and
+    yield NDJSON lines with per-text results as soon as their chunk is done, then the line with the aggregate report.
+    Texts that are too long or invalid get an error line and are not counted in the report"""
+    accumulator = MetricAccumulator()
+    # the next chunk is read while the previous one is processed
+    pending_chunk = None
+    chunk_idxs, chunk_texts = [], []
+    index = 0
+
+    async def flush(chunk):
+        idxs, task = chunk
+        chunk_accumulator = await task
+        lines = "".join(
+            json.dumps(dict(index=text_idx, **text_record), ensure_ascii=False) + "\n"
+            for text_idx, text_record in zip(idxs, chunk_accumulator.texts_records)
+        )
+        accumulator.merge(chunk_accumulator.drop_texts())
+        return lines
+
+    try:
+        # the characters are counted after parsing, the bytes cap only skips the lines that can not fit
+        async for line in read_ndjson_lines(byte_chunks=byte_chunks, max_request_bytes=max_request_bytes,
+                                            max_line_bytes=max_text_length * MAX_JSON_CHAR_BYTES + 1024):
+            text, error = parse_text_line(line=line, max_text_length=max_text_length)
+            if error is not None:
+                yield json.dumps({"index": index, "error": error}) + "\n"
+            else:
+                chunk_idxs.append(index)
+                chunk_texts.append(text)
+            index += 1
+
+            if len(chunk_texts) >= chunk_size:
+                if pending_chunk is not None:
+                    yield await flush(pending_chunk)
+                pending_chunk = (chunk_idxs, asyncio.ensure_future(batcher.submit_accumulate(texts=chunk_texts, keep_texts=True)))
+                chunk_idxs, chunk_texts = [], []
+
+        if pending_chunk is not None:
+            yield await flush(pending_chunk)
+            pending_chunk = None
+        if chunk_texts:
+            yield await flush((chunk_idxs, asyncio.ensure_future(batcher.submit_accumulate(texts=chunk_texts, keep_texts=True))))
+
+    except Exception as e:
+        if pending_chunk is not None:
+            pending_chunk[1].cancel()
+        yield json.dumps({"error": str(e) or type(e).__name__}) + "\n"
+        return
+
+    yield json.dumps({"report": accumulator.report()}) + "\n"
@@ -1,16 +1,52 @@
-from transformers import AutoTokenizer, AutoModelForTokenClassification
-from transformers import pipeline
-import spacy
-import stanza
+# torch, transformers, spacy and stanza are imported by the modules that use them, so importing ner_utils
+# (and the rule-based modules) is fast and the heavy libraries are loaded only when the models are
+import bisect
+import hashlib
+import json
+import os
 import re
 
-from typing import List, Union, Dict, Tuple
+from intervals import IntervalIndex
+from document import Document, SpanList
+
+from typing import List, Union, Dict, Tuple, Optional
 
 class BaseNER:
+    # relative cost of a call, the cascade of CodeSwitchingNERMetric runs the cheaper modules first
+    cost = 1
+    # whether __call__ uses the tokens_dicts, predict_spans does not build them for the modules that do not
+    needs_tokens = True
+
+    def fingerprint(self) -> str:
+        """hash of the module class and configuration (its str/number attributes and lists of str), used in the result
+        cache keys. Modules with other configuration that changes the predictions should override it"""
+        config = [type(self).__name__]
+        for name, value in sorted(vars(self).items()):
+            if isinstance(value, (list, tuple)) and all(isinstance(item, str) for item in value):
+                config.append((name, list(value)))
+            elif value is None or isinstance(value, (str, int, float, bool)):
+                config.append((name, value))
+
+        return hashlib.sha256(json.dumps(config, ensure_ascii=False).encode("utf-8")).hexdigest()
 
     def __call__(self, sentences: List[str], sentences_ranges: List[Dict[str, int]], **kwargs) -> List[List[Dict[str, Union[int, str]]]]:
         return []
 
+    def predict_spans(self, document: Document, sentences_idxs: List[int]) -> SpanList:
+        """predictions for the sentences (indices in the document) as a SpanList, used by CodeSwitchingNERMetric.
+        By default the dict API (__call__) is called and its predictions are converted, so a custom module only needs
+        __call__; the rule-based modules override it to skip the dicts"""
+        preds = self(
+            sentences=[document.sentences[i] for i in sentences_idxs],
+            sentences_ranges=document.sentences_ranges(sentences_idxs),
+            tokens_dicts=document.tokens_dicts_of_sentences(sentences_idxs) if self.needs_tokens else [],
+            lowercased_sentences=[document.lowercased_sentences[i] for i in sentences_idxs]
+        )
+
+        spans = SpanList()
+        spans.extend_dicts(sentences_idxs=sentences_idxs, preds=preds)
+        return spans
+
     def pred_ner_sents(self, text: str) -> Tuple[
         List[List[Dict[str, Union[int, str]]]],
         List[str],
@@ -19,25 +55,235 @@ class BaseNER:
     ]:
         return [], [], [], []
 
+    def truncated_length(self, text: str) -> int:
+        """length of the beginning of the text that pred_ner_sents analyzes, the rest is truncated. The whole text by
+        default"""
+        return len(text)
+
+    def pred_ner_sents_batch(self, texts: List[str]) -> List[Tuple[
+        List[List[Dict[str, Union[int, str]]]],
+        List[str],
+        List[Dict[str, int]],
+        List[Dict[str, Union[str, int]]]
+    ]]:
+        """pred_ner_sents for a list of texts; modules that support bulk processing should override it"""
+        return [self.pred_ner_sents(text) for text in texts]
+
 class TransformersNER(BaseNER):
+    BACKENDS = ["torch", "int8", "onnx", "onnx-int8"]
+    cost = 100
+    needs_tokens = False
+
     def __init__(self,
                  consider_labels: List[str]=[
                      "MISC", "PER", "ORG", "LOC"
                  ],
-                 modelname: str = "EvanD/xlm-roberta-base-ukrainian-ner-ukrner"):
+                 modelname: str = "EvanD/xlm-roberta-base-ukrainian-ner-ukrner",
+                 backend: str = "torch",
+                 num_threads: Optional[int] = None,
+                 cache_dir: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ner_cache"),
+                 max_batch_tokens: int = 8192,
+                 max_length: int = 512,
+                 window_overlap: int = 128):
+        """
+        backend: str, how the model is run on CPU:
+            "torch" - plain fp32 PyTorch model,
+            "int8" - PyTorch model with dynamic int8 quantization of the Linear layers,
+            "onnx" - ONNX Runtime graph, exported once into cache_dir,
+            "onnx-int8" - dynamically quantized ONNX Runtime graph, exported once into cache_dir.
+            The quantized backends trade some accuracy for speed, see compare_ner_spans / backend_check.py
+        num_threads: int, number of intra-op threads for torch / onnxruntime. If None, the library defaults are kept
+        cache_dir: str, directory for the exported ONNX graphs
+        max_batch_tokens: int, token budget of one batch (number of sentences * longest sentence length in subwords).
+            Sentences are sorted by length and packed into batches up to this budget, so short sentences are not
+            padded to the length of a long one
+        max_length: int, max number of subwords (with special tokens) the model is run on. Longer sentences are split
+            into overlapping windows instead of being truncated
+        window_overlap: int, number of subwords shared by neighbouring windows of a long sentence
+        """
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Unknown backend {backend}, expected one of {self.BACKENDS}")
+
+        import torch
+        from transformers import AutoTokenizer, AutoModelForTokenClassification, pipeline
+
+        if num_threads:
+            torch.set_num_threads(num_threads)
 
         tokenizer = AutoTokenizer.from_pretrained(modelname)
-        ner_model = AutoModelForTokenClassification.from_pretrained(modelname)
+        self.tokenizer = tokenizer
+        self.modelname = modelname
         self.consider_labels = consider_labels
+        self.backend = backend
+        self.max_batch_tokens = max_batch_tokens
+        self.max_length = min(max_length, tokenizer.model_max_length)
+        self.window_overlap = window_overlap
+
+        if backend in ["torch", "int8"]:
+            ner_model = AutoModelForTokenClassification.from_pretrained(modelname)
+            ner_model.eval()
+            if backend == "int8":
+                ner_model = torch.quantization.quantize_dynamic(ner_model, {torch.nn.Linear}, dtype=torch.qint8)
+        else:
+            ner_model = self.load_onnx_model(
+                modelname=modelname,
+                quantize=backend == "onnx-int8",
+                num_threads=num_threads,
+                cache_dir=cache_dir
+            )
 
+        # the pipeline truncates its input to model_max_length: a chunk can never go over the position embeddings,
+        # even if it is tokenized into more subwords than in split_windows
+        tokenizer.model_max_length = self.max_length
         self.ppl = pipeline("ner",
                             model=ner_model,
                             tokenizer=tokenizer,
                             aggregation_strategy="simple"
                             )
 
+    @staticmethod
+    def load_onnx_model(modelname: str, quantize: bool, num_threads: Optional[int], cache_dir: str):
+        """load the ONNX Runtime model from cache_dir, export (and quantize) it there first if it is missing"""
+        try:
+            import onnxruntime
+            from optimum.onnxruntime import ORTModelForTokenClassification, ORTQuantizer
+            from optimum.onnxruntime.configuration import AutoQuantizationConfig
+        except ImportError:
+            raise ImportError("onnx backends require optimum[onnxruntime]: pip install optimum[onnxruntime]")
+
+        session_options = onnxruntime.SessionOptions()
+        if num_threads:
+            session_options.intra_op_num_threads = num_threads
+
+        export_dir = os.path.join(cache_dir, modelname.replace("/", "--") + "-onnx")
+        if not os.path.exists(os.path.join(export_dir, "model.onnx")):
+            ORTModelForTokenClassification.from_pretrained(modelname, export=True).save_pretrained(export_dir)
+
+        file_name = "model.onnx"
+        if quantize:
+            file_name = "model_quantized.onnx"
+            if not os.path.exists(os.path.join(export_dir, file_name)):
+                quantizer = ORTQuantizer.from_pretrained(export_dir, file_name="model.onnx")
+                quantizer.quantize(
+                    save_dir=export_dir,
+                    quantization_config=AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+                )
+
+        return ORTModelForTokenClassification.from_pretrained(
+            export_dir,
+            file_name=file_name,
+            session_options=session_options
+        )
+
+    def split_windows(self, sentences: List[str]) -> List[Dict[str, int]]:
+        """split sentences into chunks of at most self.max_length subwords.
+        Returns chunks as dicts with the sentence index, the chunk chars range in the sentence, the number of subwords
+        and the start of the chunk's own region: predictions starting before it belong to the previous window.
+        Windows start and end on word boundaries (unless a single word is longer than a window), so the chunk text
+        is tokenized by the pipeline into the same subwords"""
+        num_special_tokens = self.tokenizer.num_special_tokens_to_add()
+        window_size = self.max_length - num_special_tokens
+
+        encodings = self.tokenizer(sentences, add_special_tokens=False, return_offsets_mapping=True)
+
+        chunks = []
+        for sent_idx, (sentence, offsets) in enumerate(zip(sentences, encodings["offset_mapping"])):
+            if len(offsets) <= window_size:
+                chunks.append(
+                    {
+                        "sent_idx": sent_idx,
+                        "start": 0,
+                        "end": len(sentence),
+                        "own_start": 0,
+                        "num_tokens": len(offsets) + num_special_tokens
+                    }
+                )
+                continue
+
+            word_ids = encodings.word_ids(sent_idx)
+
+            def word_start(token_idx: int, min_token_idx: int) -> int:
+                """first subword of the word of token_idx, not before min_token_idx"""
+                while token_idx > min_token_idx and word_ids[token_idx] == word_ids[token_idx - 1]:
+                    token_idx -= 1
+                return token_idx
+
+            first_token = 0
+            while True:
+                end_token = min(first_token + window_size, len(offsets))
+                if end_token < len(offsets):
+                    # the window ends before the word that does not fit whole
+                    end_token = word_start(end_token, first_token + 1)
+                    if end_token == first_token + 1 and word_ids[end_token] == word_ids[first_token]:
+                        end_token = first_token + window_size
+
+                window_offsets = offsets[first_token: end_token]
+                chunk = {
+                    "sent_idx": sent_idx,
+                    "start": window_offsets[0][0],
+                    "end": window_offsets[-1][1],
+                    "own_start": 0,
+                    "num_tokens": len(window_offsets) + num_special_tokens
+                }
+                if chunks and chunks[-1]["sent_idx"] == sent_idx:
+                    # the overlap of two windows is split in the middle between them
+                    chunk["own_start"] = (chunk["start"] + chunks[-1]["end"]) // 2
+                chunks.append(chunk)
+
+                if end_token >= len(offsets):
+                    break
+                next_first_token = word_start(max(end_token - self.window_overlap, first_token + 1), first_token + 1)
+                if word_ids[next_first_token] == word_ids[next_first_token - 1]:
+                    # no word starts within the overlap, the next window starts where this one ends
+                    next_first_token = end_token
+                first_token = next_first_token
+
+        return chunks
+
+    def pack_batches(self, chunks: List[Dict[str, int]]) -> List[List[Dict[str, int]]]:
+        """sort chunks by length and pack them into batches within self.max_batch_tokens budget"""
+        batches = []
+        batch = []
+        for chunk in sorted(chunks, key=lambda chunk: chunk["num_tokens"]):
+            if batch and (len(batch) + 1) * chunk["num_tokens"] > self.max_batch_tokens:
+                batches.append(batch)
+                batch = []
+            batch.append(chunk)
+        if batch:
+            batches.append(batch)
+
+        return batches
+
     def __call__(self, sentences: List[str], sentences_ranges: List[Dict[str, int]], **kwargs) -> List[List[Dict[str, Union[int, str]]]]:
-        preds = self.ppl(sentences)
+        preds = [[] for _ in sentences]
+        if not sentences:
+            return preds
+
+        chunks = self.split_windows(sentences=sentences)
+        for i, chunk in enumerate(chunks):
+            # end of the chunk's own region is where the own region of the next window of the sentence starts
+            chunk["own_end"] = len(sentences[chunk["sent_idx"]])
+            if i + 1 < len(chunks) and chunks[i + 1]["sent_idx"] == chunk["sent_idx"]:
+                chunk["own_end"] = chunks[i + 1]["own_start"]
+
+        import torch
+
+        for batch in self.pack_batches(chunks=chunks):
+            with torch.inference_mode():
+                batch_preds = self.ppl(
+                    [sentences[chunk["sent_idx"]][chunk["start"]: chunk["end"]] for chunk in batch],
+                    batch_size=len(batch)
+                )
+
+            for chunk, chunk_preds in zip(batch, batch_preds):
+                for pred in chunk_preds:
+                    pred["start"] += chunk["start"]
+                    pred["end"] += chunk["start"]
+                    if chunk["own_start"] <= pred["start"] < chunk["own_end"]:
+                        preds[chunk["sent_idx"]].append(pred)
+
+        for sent_preds in preds:
+            sent_preds.sort(key=lambda pred: pred["start"])
 
         output = []
         for sentence_idx_range, pred_dicts in zip(sentences_ranges, preds):
@@ -56,22 +302,67 @@ class TransformersNER(BaseNER):
         return output
 
 
+def compare_ner_spans(reference_preds: List[List[Dict[str, Union[int, str]]]],
+                      candidate_preds: List[List[Dict[str, Union[int, str]]]]) -> Dict[str, float]:
+    """compare entity spans (start, end, label) of a candidate NER module with the reference one, sentence by sentence.
+    Returns precision/recall/f1 of the candidate spans and the ratio of sentences with identical spans"""
+    num_matched, num_reference, num_candidate, num_same_sentences = 0, 0, 0, 0
+    for sent_reference_preds, sent_candidate_preds in zip(reference_preds, candidate_preds):
+        reference_spans = {(pred["start"], pred["end"], pred["label"]) for pred in sent_reference_preds}
+        candidate_spans = {(pred["start"], pred["end"], pred["label"]) for pred in sent_candidate_preds}
+
+        num_matched += len(reference_spans & candidate_spans)
+        num_reference += len(reference_spans)
+        num_candidate += len(candidate_spans)
+        num_same_sentences += int(reference_spans == candidate_spans)
+
+    precision = num_matched / num_candidate if num_candidate else 1.0
+    recall = num_matched / num_reference if num_reference else 1.0
+
+    return {
+        "precision": precision,
+        "recall": recall,
+        "f1": 2 * precision * recall / (precision + recall) if precision + recall else 0.0,
+        "same_sentences_ratio": num_same_sentences / len(reference_preds) if reference_preds else 1.0
+    }
 
 
 class SpacyNER(BaseNER):
+    cost = 20
+    needs_tokens = False
+
     def __init__(self,
                  consider_labels: List[str] = [
                      "ORG", "PER", "MISC", "LOC", "PERSON",
                      "LOCATION", "GPE"
                  ],
-                 modelname: str ="uk_core_news_lg"):
-        self.nlp = spacy.load(modelname)
+                 modelname: str ="uk_core_news_lg",
+                 enable_components: List[str] = ["tok2vec", "ner"],
+                 batch_size: int = 256,
+                 n_process: int = 1):
+        """
+        enable_components: list of str, pipeline components to keep. Only doc.ents is used, so everything else
+            (parser, lemmatizer, morphologizer, ...) is excluded at load time and never loaded
+        batch_size: int, number of sentences that nlp.pipe buffers and processes together
+        n_process: int, number of processes for nlp.pipe
+        """
+        import spacy
+
+        # the component names are read from the meta.json of the package (or of the model directory) without loading it
+        model_path = spacy.util.get_package_path(modelname) if spacy.util.is_package(modelname) else modelname
+        model_meta = spacy.util.get_model_meta(model_path)
+        components = model_meta.get("components") or model_meta.get("pipeline", [])
+
+        self.nlp = spacy.load(modelname, exclude=[name for name in components if name not in enable_components])
+        self.modelname = modelname
         self.consider_labels = consider_labels
+        self.batch_size = batch_size
+        self.n_process = n_process
 
     def __call__(self, sentences: List[str], sentences_ranges: List[Dict[str, int]], **kwargs) -> List[List[Dict[str, Union[int, str]]]]:
         preds = []
-        for sentence, sentence_idx_range in zip(sentences, sentences_ranges):
-            doc = self.nlp(sentence)
+        docs = self.nlp.pipe(sentences, batch_size=self.batch_size, n_process=self.n_process)
+        for doc, sentence_idx_range in zip(docs, sentences_ranges):
             doc_ents = []
             for ent in doc.ents:
                 if ent.label_ in self.consider_labels:
@@ -89,16 +380,78 @@ class SpacyNER(BaseNER):
         return preds
 
 
+# sentence-ending punctuation, with the closing quotes / brackets and the whitespace after it
+SENTENCE_END_PATTERN = re.compile(r"[.!?…]+[\"'»”)\]]*\s+")
+
+
+def find_safe_boundary(text: str, start: int, end: int) -> int:
+    """position in (start, end] to cut the text at without splitting a sentence, if possible: after the last paragraph
+    break, sentence-ending punctuation, line break or space in the second half of text[start:end], tried in this order.
+    end if there is none of them"""
+    if end >= len(text):
+        return len(text)
+
+    min_boundary = start + (end - start) // 2
+
+    position = text.rfind("\n\n", min_boundary, end)
+    if position != -1:
+        return position + 2
+
+    sentence_end = None
+    for match in SENTENCE_END_PATTERN.finditer(text, min_boundary, end):
+        sentence_end = match.end()
+    if sentence_end is not None:
+        return sentence_end
+
+    for separator in ("\n", " "):
+        position = text.rfind(separator, min_boundary, end)
+        if position != -1:
+            return position + 1
+
+    return end
+
+
+def split_text_windows(text: str, window_chars: int) -> List[Tuple[int, int]]:
+    """split the text into consecutive (start, end) windows of at most window_chars, cut at find_safe_boundary"""
+    windows = []
+    start = 0
+    while start < len(text):
+        end = find_safe_boundary(text=text, start=start, end=start + window_chars)
+        windows.append((start, end))
+        start = end
+
+    return windows
+
+
 class StanzaNER(BaseNER):
+    needs_tokens = False
+
     def __init__(self,
                  ppl_lang: str='uk',
                  consider_labels=[
                      "ORG", "PERS", "MISC", "LOC", "PERSON", "PER",
                      "JOB", "DOC","ART"
-                 ]
+                 ],
+                 window_chars: Optional[int] = None,
+                 max_document_chars: Optional[int] = None
                  ):
+        """
+        window_chars: int, texts longer than it are split (see split_text_windows) into windows of at most window_chars
+            at paragraph / sentence boundaries and passed through stanza one window at a time, so the memory does not
+            grow with the text. Offsets are remapped to the text. A window can end in the middle of a sentence (at a
+            space, if there is no better boundary), so the sentences may differ from the ones of the whole text.
+            If None (default), texts are passed whole
+        max_document_chars: int, optional, only the first max_document_chars of a text (cut at a boundary as the
+            windows) are analyzed, the rest is truncated. The metric reports the truncated texts and chars
+        """
+        import stanza
+
         self.nlp = stanza.Pipeline(lang=ppl_lang, processors='tokenize,ner')
+        self.ppl_lang = ppl_lang
         self.consider_labels = consider_labels
+        self.window_chars = window_chars
+        self.max_document_chars = max_document_chars
+
     def __call__(self, sentences: List[str], **kwargs) -> List[List[Dict[str, Union[int, str]]]]:
         preds = []
         for sentence in sentences:
@@ -115,21 +468,82 @@ class StanzaNER(BaseNER):
 
         return preds
 
+    def truncated_length(self, text: str) -> int:
+        if self.max_document_chars is None or len(text) <= self.max_document_chars:
+            return len(text)
+        return find_safe_boundary(text=text, start=0, end=self.max_document_chars)
+
     def pred_ner_sents(self, text: str) -> Tuple[
         List[List[Dict[str, Union[int, str]]]],
         List[str],
         List[Dict[str, int]],
         List[Dict[str, Union[str, int]]]
     ]:
-        doc = self.nlp(text)
+        return self.pred_ner_sents_batch(texts=[text])[0]
 
+    def pred_ner_sents_batch(self, texts: List[str]) -> List[Tuple[
+        List[List[Dict[str, Union[int, str]]]],
+        List[str],
+        List[Dict[str, int]],
+        List[Dict[str, Union[str, int]]]
+    ]]:
+        """run all the texts that fit into one window through stanza in one bulk call, the longer ones window by window"""
+        if not texts:
+            return []
+
+        import stanza
+
+        texts = [text[:self.truncated_length(text)] for text in texts]
+        output = [None for _ in texts]
+
+        short_texts_idxs = [
+            i for i, text in enumerate(texts) if self.window_chars is None or len(text) <= self.window_chars
+        ]
+        if short_texts_idxs:
+            docs = self.nlp([stanza.Document([], text=texts[i]) for i in short_texts_idxs])
+            for i, doc in zip(short_texts_idxs, docs):
+                output[i] = self.doc_to_ner_sents(doc=doc)
+
+        for i, text in enumerate(texts):
+            if output[i] is None:
+                output[i] = self.pred_long_document(text=text)
+
+        return output
+
+    def pred_long_document(self, text: str) -> Tuple[
+        List[List[Dict[str, Union[int, str]]]],
+        List[str],
+        List[Dict[str, int]],
+        List[Dict[str, Union[str, int]]]
+    ]:
+        """pred_ner_sents of a text longer than self.window_chars, its windows are passed through stanza one by one"""
+        preds, sentences, sentences_ranges, tokens = [], [], [], []
+        for window_start, window_end in split_text_windows(text=text, window_chars=self.window_chars):
+            window_preds, window_sentences, window_sentences_ranges, window_tokens = self.doc_to_ner_sents(
+                doc=self.nlp(text[window_start: window_end]),
+                offset=window_start
+            )
+            preds += window_preds
+            sentences += window_sentences
+            sentences_ranges += window_sentences_ranges
+            tokens += window_tokens
+
+        return preds, sentences, sentences_ranges, tokens
+
+    def doc_to_ner_sents(self, doc, offset: int = 0) -> Tuple[
+        List[List[Dict[str, Union[int, str]]]],
+        List[str],
+        List[Dict[str, int]],
+        List[Dict[str, Union[str, int]]]
+    ]:
+        """offset: int, position of the doc in the text, added to the offsets"""
         sentences = []
         sentences_ranges = []
         preds = []
         tokens = []
 
         for sent in doc.sentences:
-            sentences_ranges.append({"start": sent.tokens[0].start_char, "end": sent.tokens[-1].end_char})
+            sentences_ranges.append({"start": sent.tokens[0].start_char + offset, "end": sent.tokens[-1].end_char + offset})
             sentences.append(sent.text)
             sent_preds = []
             for ent in sent.ents:
@@ -137,8 +551,8 @@ class StanzaNER(BaseNER):
                     {
                         "text": ent.text,
                         "label": ent.type,
-                        "start": ent.start_char,
-                        "end": ent.end_char,
+                        "start": ent.start_char + offset,
+                        "end": ent.end_char + offset,
                         "start_in_sentence": sent.text.index(ent.text),
                         "end_in_sentence": sent.text.index(ent.text) + len(ent.text)
                     }
@@ -149,8 +563,8 @@ class StanzaNER(BaseNER):
                 tokens.append(
                     {
                         "text": token.text,
-                        "start": token.start_char,
-                        "end": token.end_char
+                        "start": token.start_char + offset,
+                        "end": token.end_char + offset
                     }
                 )
 
@@ -161,13 +575,19 @@ class StanzaNER(BaseNER):
 
 
 
-class RegexFinder:
+class RegexFinder(BaseNER):
+    needs_tokens = False
+
     def __init__(self, pattern: str, labelname: str, do_lowercase=False):
         self.pattern = pattern
+        self.compiled_pattern = re.compile(pattern)
         self.labelname = labelname
         self.do_lowercase = do_lowercase
 
-    def __call__(self, sentences: List[str],  sentences_ranges: List[Dict[str, int]], **kwargs) -> List[List[Dict[str, Union[int, str]]]]:
+    def __call__(self, sentences: List[str],  sentences_ranges: List[Dict[str, int]],
+                 lowercased_sentences: Optional[List[str]] = None, **kwargs) -> List[List[Dict[str, Union[int, str]]]]:
+        """lowercased_sentences: optional, sentences already lowercased by the caller,
+            so they are not lowercased again by each finder with do_lowercase"""
         output = [
             [] for _ in sentences
         ]
@@ -175,10 +595,10 @@ class RegexFinder:
         for i, (sentence, sentence_idx_range) in enumerate(zip(sentences, sentences_ranges)):
             sentence_to_match = sentence
             if self.do_lowercase:
-                sentence_to_match = sentence_to_match.lower()
+                sentence_to_match = lowercased_sentences[i] if lowercased_sentences is not None else sentence.lower()
             matches = [
                 (match.group(), match.start(), match.end()) for match in
-                re.finditer(self.pattern, sentence_to_match) if match.group()]
+                self.compiled_pattern.finditer(sentence_to_match) if match.group()]
 
             for match_text, match_start, match_end in matches:
                 output[i] += [
@@ -194,12 +614,225 @@ class RegexFinder:
 
         return output
 
+    def predict_spans(self, document: Document, sentences_idxs: List[int]) -> SpanList:
+        spans = SpanList()
+        sentences = document.lowercased_sentences if self.do_lowercase else document.sentences
+        for i in sentences_idxs:
+            sentence_start = document.sentences_starts[i]
+            for match in self.compiled_pattern.finditer(sentences[i]):
+                if match.end() > match.start():
+                    spans.append(i, match.start() + sentence_start, match.end() + sentence_start, self.labelname)
+
+        return spans
+
+
+def is_word_char(char: str) -> bool:
+    """same as \\w in python re"""
+    return char.isalnum() or char == "_"
+
+
+class GazetteerFinder(BaseNER):
+    """Finds phrases from a (large) list with a precompiled Aho-Corasick automaton.
+    Gives the same matches as RegexFinder with the pattern
+        prefix + "(?:" + "|".join(re.escape(phrase) for phrase in phrases) + ")"
+    where the prefix is empty or r"\b" + prefix_class + "+", and the pattern is wrapped in r"\b" if word_boundaries.
+    As in the regex alternation, the earlier phrase in the list wins among phrases that start at the same position.
+    """
+    needs_tokens = False
+
+    def __init__(self, phrases: List[str], labelname: str, do_lowercase: bool = False,
+                 word_boundaries: bool = False, prefix_class: Optional[str] = None):
+        """
+        phrases: list of str, literal phrases to find
+        labelname: str, label of the predictions
+        do_lowercase: bool, match on the lowercased sentence
+        word_boundaries: bool, the match should start and end on a word boundary (as r"\b")
+        prefix_class: str, optional regex char class (e.g. r"[\w.-]"), one or more chars of which should go before
+            the phrase. The match then starts on a word boundary and the prefix is taken greedily as in regex
+        """
+        self.labelname = labelname
+        self.do_lowercase = do_lowercase
+        self.word_boundaries = word_boundaries or prefix_class is not None
+        self.prefix_class = prefix_class
+        self.prefix_pattern = re.compile(prefix_class + "+") if prefix_class is not None else None
+        self.phrases_hash = hashlib.sha256("\n".join(phrases).encode("utf-8")).hexdigest()
+        self.build_automaton(phrases=phrases)
+
+    def build_automaton(self, phrases: List[str]):
+        """build trie transitions, failure links and outputs (phrase index, phrase length) of every node"""
+        self.transitions = [{}]
+        self.outputs = [[]]
+        for phrase_idx, phrase in enumerate(phrases):
+            if not phrase:
+                continue
+            node = 0
+            for char in phrase:
+                if char not in self.transitions[node]:
+                    self.transitions[node][char] = len(self.transitions)
+                    self.transitions.append({})
+                    self.outputs.append([])
+                node = self.transitions[node][char]
+            if not self.outputs[node]:
+                self.outputs[node].append((phrase_idx, len(phrase)))
+
+        self.fail = [0] * len(self.transitions)
+        queue = list(self.transitions[0].values())
+        for node in queue:
+            for char, next_node in self.transitions[node].items():
+                fail_node = self.fail[node]
+                while fail_node and char not in self.transitions[fail_node]:
+                    fail_node = self.fail[fail_node]
+                self.fail[next_node] = self.transitions[fail_node].get(char, 0)
+                self.outputs[next_node] = self.outputs[next_node] + self.outputs[self.fail[next_node]]
+                queue.append(next_node)
+
+    def find_phrases_starts(self, text: str) -> Dict[int, Tuple[int, int]]:
+        """for each position where at least one phrase starts (and ends on a word boundary, if required)
+        returns the phrase of the lowest index, as (phrase index, end)"""
+        transitions, fail, outputs = self.transitions, self.fail, self.outputs
+        root_transitions = transitions[0]
+        word_boundaries = self.word_boundaries
+        starts = {}
+        node = 0
+        for i, char in enumerate(text):
+            if not node:
+                node = root_transitions.get(char, 0)
+                if not node:
+                    continue
+            else:
+                while node and char not in transitions[node]:
+                    node = fail[node]
+                node = transitions[node].get(char, 0)
+
+            if outputs[node]:
+                end = i + 1
+                if word_boundaries and not self.is_boundary(text, end):
+                    continue
+                for phrase_idx, phrase_length in outputs[node]:
+                    start = end - phrase_length
+                    if start not in starts or starts[start][0] > phrase_idx:
+                        starts[start] = (phrase_idx, end)
+
+        return starts
+
+    @staticmethod
+    def is_boundary(text: str, position: int) -> bool:
+        left = position > 0 and is_word_char(text[position - 1])
+        right = position < len(text) and is_word_char(text[position])
+        return left != right
+
+    def find_matches(self, text: str) -> List[Tuple[int, int]]:
+        starts = self.find_phrases_starts(text=text)
+        if not starts:
+            return []
+
+        matches = []
+        if self.prefix_pattern is None:
+            position = 0
+            for start in sorted(starts):
+                if start < position or (self.word_boundaries and not self.is_boundary(text, start)):
+                    continue
+                matches.append((start, starts[start][1]))
+                position = starts[start][1]
+            return matches
+
+        # the prefix is greedy: for a run of prefix chars the phrase that starts the latest inside it (or right after it)
+        # is taken, the match starts at the first word boundary of the run
+        phrases_starts = sorted(starts)
+        position = 0
+        for run in self.prefix_pattern.finditer(text):
+            run_start, run_end = max(run.start(), position), run.end()
+            if run_start >= run_end:
+                continue
+            phrase_start_idx = bisect.bisect_right(phrases_starts, run_end) - 1
+            if phrase_start_idx < 0:
+                continue
+            phrase_start = phrases_starts[phrase_start_idx]
+            for start in range(run_start, phrase_start):
+                if self.is_boundary(text, start):
+                    matches.append((start, starts[phrase_start][1]))
+                    position = starts[phrase_start][1]
+                    break
+
+        return matches
+
+    def __call__(self, sentences: List[str], sentences_ranges: List[Dict[str, int]],
+                 lowercased_sentences: Optional[List[str]] = None, **kwargs) -> List[List[Dict[str, Union[int, str]]]]:
+        output = []
+        for i, (sentence, sentence_idx_range) in enumerate(zip(sentences, sentences_ranges)):
+            sentence_to_match = sentence
+            if self.do_lowercase:
+                sentence_to_match = lowercased_sentences[i] if lowercased_sentences is not None else sentence.lower()
+
+            output.append(
+                [
+                    {
+                        "text": sentence_to_match[match_start: match_end],
+                        "label": self.labelname,
+                        "start_in_sentence": match_start,
+                        "end_in_sentence": match_end,
+                        "start": match_start + sentence_idx_range["start"],
+                        "end": match_end + sentence_idx_range["start"],
+                    } for match_start, match_end in self.find_matches(text=sentence_to_match)
+                ]
+            )
+
+        return output
+
+    def predict_spans(self, document: Document, sentences_idxs: List[int]) -> SpanList:
+        spans = SpanList()
+        sentences = document.lowercased_sentences if self.do_lowercase else document.sentences
+        for i in sentences_idxs:
+            sentence_start = document.sentences_starts[i]
+            for match_start, match_end in self.find_matches(text=sentences[i]):
+                spans.append(i, match_start + sentence_start, match_end + sentence_start, self.labelname)
+
+        return spans
+
+
+def group_tokens_by_sentences(tokens_dicts: List[Dict[str, Union[str, int]]],
+                              sentences_ranges: List[Dict[str, int]]) -> List[List[Dict[str, Union[str, int]]]]:
+    """for each sentence, the tokens (in their original order) that are inside the sentence range.
+    One pass over the tokens with an interval index over the sentences"""
+    sentences_index = IntervalIndex([(sent_range["start"], sent_range["end"]) for sent_range in sentences_ranges])
+
+    sentences_tokens = [[] for _ in sentences_ranges]
+    for token_dict in tokens_dicts:
+        for sent_idx in sentences_index.containing(start=token_dict["start"], end=token_dict["end"]):
+            sentences_tokens[sent_idx].append(token_dict)
+
+    return sentences_tokens
+
+
+def predict_tokens_spans(ner_module: BaseNER, document: Document, sentences_idxs: List[int], label: str, is_match) -> SpanList:
+    """predict_spans of the token-level modules: a prediction for every token of the sentences that is_match.
+    Without overlapping sentences a token is in one sentence at most, so the tokens are taken by their sentence indices,
+    otherwise the dict API of the module is used"""
+    if not document.sentences_disjoint:
+        return BaseNER.predict_spans(ner_module, document=document, sentences_idxs=sentences_idxs)
+
+    spans = SpanList()
+    sentences_idxs_set = set(sentences_idxs)
+    for token_text, token_start, token_end, token_sentence_idx in zip(
+            document.tokens_texts, document.tokens_starts, document.tokens_ends, document.tokens_sentences_idxs
+    ):
+        if token_sentence_idx in sentences_idxs_set and is_match(token_text):
+            spans.append(token_sentence_idx, token_start, token_end, label)
+
+    return spans
+
+
 class InclusionSymbols(BaseNER):
     def __init__(self, inclusion_symbols_list: List[str]):
         self.inclusion_symbols_list = inclusion_symbols_list
+        # one char symbols are checked with one set intersection, the rest by substring search
+        self.inclusion_chars = frozenset(symbol for symbol in inclusion_symbols_list if len(symbol) == 1)
+        self.inclusion_substrings = [symbol for symbol in inclusion_symbols_list if len(symbol) != 1]
 
     def check_inclusion(self, text):
-        for symbol in self.inclusion_symbols_list:
+        if not self.inclusion_chars.isdisjoint(text):
+            return True
+        for symbol in self.inclusion_substrings:
             if symbol in text:
                 return True
         return False
@@ -207,45 +840,60 @@ class InclusionSymbols(BaseNER):
     def __call__(self, tokens_dicts, sentences_ranges, **kwargs):
         preds = []
 
-        for sentence_range in sentences_ranges:
-            sent_preds = []
-
-            for token_dict in tokens_dicts:
-                if token_dict["start"] >= sentence_range["start"] and token_dict["end"] <= sentence_range["end"]:
-                    if self.check_inclusion(token_dict["text"]):
-                        sent_preds.append(
-                            {
-                                "text": token_dict["text"],
-                                "label": "CorpusCommonTokens",
-                                "start": token_dict["start"],
-                                "end": token_dict["end"]
-                            }
-                        )
-            preds.append(sent_preds)
+        for sentence_tokens in group_tokens_by_sentences(tokens_dicts=tokens_dicts, sentences_ranges=sentences_ranges):
+            preds.append(
+                [
+                    {
+                        "text": token_dict["text"],
+                        "label": "CorpusCommonTokens",
+                        "start": token_dict["start"],
+                        "end": token_dict["end"]
+                    } for token_dict in sentence_tokens if self.check_inclusion(token_dict["text"])
+                ]
+            )
 
         return preds
 
+    def predict_spans(self, document: Document, sentences_idxs: List[int]) -> SpanList:
+        return predict_tokens_spans(
+            ner_module=self,
+            document=document,
+            sentences_idxs=sentences_idxs,
+            label="CorpusCommonTokens",
+            is_match=self.check_inclusion
+        )
+
 class CorpusCommonTokensFinder(BaseNER):
     def __init__(self, comon_tokens_list: List[str]):
         self.comon_tokens_list = comon_tokens_list
+        self.comon_tokens_set = frozenset(comon_tokens_list)
 
     def __call__(self, tokens_dicts, sentences_ranges, **kwargs):
         preds = []
 
-        for sentence_range in sentences_ranges:
-            sent_preds = []
-
-            for token_dict in tokens_dicts:
-                if token_dict["start"] >= sentence_range["start"] and token_dict["end"] <= sentence_range["end"]:
-                    if token_dict["text"] in self.comon_tokens_list or token_dict["text"].lower() in self.comon_tokens_list:
-                        sent_preds.append(
-                            {
-                                "text": token_dict["text"],
-                                "label": "CorpusCommonTokens",
-                                "start": token_dict["start"],
-                                "end": token_dict["end"]
-                            }
-                        )
-            preds.append(sent_preds)
+        for sentence_tokens in group_tokens_by_sentences(tokens_dicts=tokens_dicts, sentences_ranges=sentences_ranges):
+            preds.append(
+                [
+                    {
+                        "text": token_dict["text"],
+                        "label": "CorpusCommonTokens",
+                        "start": token_dict["start"],
+                        "end": token_dict["end"]
+                    } for token_dict in sentence_tokens
+                    if token_dict["text"] in self.comon_tokens_set or token_dict["text"].lower() in self.comon_tokens_set
+                ]
+            )
 
         return preds
+
+    def is_common_token(self, text: str) -> bool:
+        return text in self.comon_tokens_set or text.lower() in self.comon_tokens_set
+
+    def predict_spans(self, document: Document, sentences_idxs: List[int]) -> SpanList:
+        return predict_tokens_spans(
+            ner_module=self,
+            document=document,
+            sentences_idxs=sentences_idxs,
+            label="CorpusCommonTokens",
+            is_match=self.is_common_token
+        )
@@ -0,0 +1,89 @@
+from metric_accumulator import MetricAccumulator
+from threads import pin_threads
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+
+from typing import List, Dict, Union, Any, Callable, Optional, Tuple
+
+# the metric of the worker process, loaded once by the pool initializer
+_worker_metric = None
+
+
+def _init_worker(loader: Optional[Callable], loader_kwargs: Dict[str, Any], threads_per_worker: int):
+    global _worker_metric
+
+    # pin the math libraries threads before the loader imports torch (if it does), so the workers do not
+    # oversubscribe the cores, and once more after it for the torch it imported
+    pin_threads(threads_per_worker)
+
+    if loader is None:
+        from loaders import load_metric
+        loader = load_metric
+
+    _worker_metric = loader(**loader_kwargs)
+    pin_threads(threads_per_worker)
+
+
+def _process_chunk(chunk: Tuple[List[str], int, bool]) -> Dict[str, Any]:
+    texts, batch_size, keep_texts = chunk
+
+    accumulator = MetricAccumulator(metric=_worker_metric, keep_texts=keep_texts)
+    accumulator.update(texts=texts, batch_size=batch_size)
+
+    return accumulator.to_dict()
+
+
+class ParallelCodeSwitchingNERMetric:
+    """Runs CodeSwitchingNERMetric over a process pool.
+    Every worker loads its own metric once (with load_metric by default) and processes chunks of the texts, the chunks
+    results are merged in the order of the texts, so the report is the same as of CodeSwitchingNERMetric.calculate"""
+
+    def __init__(self,
+                 n_workers: int = os.cpu_count(),
+                 threads_per_worker: int = 1,
+                 loader: Optional[Callable] = None,
+                 loader_kwargs: Optional[Dict[str, Any]] = None):
+        """
+        n_workers: int, number of worker processes
+        threads_per_worker: int, number of torch / BLAS threads of every worker
+        loader: module-level function that builds the metric in a worker. If None, loaders.load_metric is used
+        loader_kwargs: dict, keyword arguments of the loader
+        """
+        self.n_workers = n_workers
+        self.executor = ProcessPoolExecutor(
+            max_workers=n_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(loader, loader_kwargs or {}, threads_per_worker)
+        )
+
+    def accumulate(self, texts: List[str], chunk_size: int = 256, batch_size: int = 32,
+                   keep_texts: bool = False) -> MetricAccumulator:
+        """
+        chunk_size: int, number of texts sent to a worker at once
+        batch_size: int, batch size of the metric inside a worker
+        keep_texts: bool, keep the per-text records, see MetricAccumulator
+        """
+        chunks = [
+            (texts[chunk_start: chunk_start + chunk_size], batch_size, keep_texts)
+            for chunk_start in range(0, len(texts), chunk_size)
+        ]
+
+        accumulator = MetricAccumulator(keep_texts=keep_texts)
+        for chunk_state in self.executor.map(_process_chunk, chunks):
+            accumulator.merge(MetricAccumulator.from_dict(chunk_state))
+
+        return accumulator
+
+    def calculate(self, texts: List[str], chunk_size: int = 256, batch_size: int = 32) -> Dict[str, Union[str, float]]:
+        return self.accumulate(texts=texts, chunk_size=chunk_size, batch_size=batch_size).report()
+
+    def close(self):
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -2,30 +2,45 @@ import re
 import unicodedata
 
 
+class _SymbolsTable(dict):
+    """str.translate table of remove_accents_keep_ukr_symbol, filled lazily per codepoint"""
+    def __missing__(self, codepoint: int) -> str:
+        value = Preprocessor.remove_accents_keep_ukr_symbol(symbol=chr(codepoint))
+        self[codepoint] = value
+        return value
+
 
 class Preprocessor:
+    html_pattern = re.compile('<[^<]+?>')
+
+    symbols_table = _SymbolsTable()
+
     @classmethod
     def remove_html(cls, text: str) -> str:
-        return re.sub('<[^<]+?>', '', text)
+        return cls.html_pattern.sub('', text)
+
+    @classmethod
+    def remove_accents_keep_ukr_symbol(cls, symbol: str) -> str:
+        if symbol.lower() in ["й", "є", "ю", "ї"]:
+            return symbol
+        elif symbol in ["Є́", "Ї́", "є́", "ї́"]:
+            if symbol == "Є́":
+                return "Є"
+            if symbol == "Ї́":
+                return "Ї"
+            if symbol == "є́":
+                return "є"
+            if symbol == "ї́":
+                return "ї"
+        return cls.remove_accents(text=symbol)
 
     @classmethod
     def remove_accents_keep_ukr_symbols(cls, text):
-        out = ""
-        for symbol in text:
-            if symbol.lower() in ["й", "є", "ю", "ї"]:
-                out += symbol
-            elif symbol in ["Є́", "Ї́", "є́", "ї́"]:
-                if symbol == "Є́":
-                    out += "Є"
-                if symbol == "Ї́":
-                    out += "Ї"
-                if symbol == "є́":
-                    out += "є"
-                if symbol == "ї́":
-                    out += "ї"
-            else:
-                out += cls.remove_accents(text=symbol)
-        return out
+        # every symbol is mapped independently, so the mapping is done with a per codepoint table:
+        # ASCII symbols never change, ASCII and Cyrillic symbols are precomputed, the rest are computed once when met
+        if text.isascii():
+            return text
+        return text.translate(cls.symbols_table)
 
     @classmethod
     def remove_accents(cls, text):
@@ -47,4 +62,10 @@ class Preprocessor:
         pr_text = cls.remove_html(text=pr_text)
         pr_text = cls.remove_accents_keep_ukr_symbols(text=pr_text)
 
-        return pr_text
\ No newline at end of file
+        return pr_text
+
+
+# ASCII, Latin-1 and Cyrillic blocks are filled in advance
+for _codepoint in list(range(0x0100)) + list(range(0x0400, 0x0530)):
+    Preprocessor.symbols_table[_codepoint] = Preprocessor.remove_accents_keep_ukr_symbol(symbol=chr(_codepoint))
+
@@ -0,0 +1,97 @@
+import hashlib
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from typing import Any, Dict, List, Optional
+
+
+class ResultCache:
+    """Content-addressed cache of the per-text analysis results of CodeSwitchingNERMetric.
+
+    Keys are hashes of the preprocessed text and the metric configuration fingerprint, values are JSON-serializable
+    dicts. The in-memory tier is an LRU with a limit on the total size of the serialized values, the optional on-disk
+    tier is an SQLite database that is shared between runs (and processes)."""
+
+    # bump when the format of the cached results changes
+    VERSION = "3"
+
+    def __init__(self, max_memory_bytes: int = 256 * 1024 * 1024, db_path: Optional[str] = None):
+        """
+        max_memory_bytes: int, max total size of the serialized results kept in memory
+        db_path: str, path to the SQLite database of the on-disk tier. If None, only memory is used
+        """
+        self.max_memory_bytes = max_memory_bytes
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+        self.lock = threading.Lock()
+
+        self.db = None
+        if db_path is not None:
+            self.db = sqlite3.connect(db_path, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value BLOB)")
+            self.db.commit()
+
+        self.hits, self.misses = 0, 0
+
+    @classmethod
+    def make_key(cls, fingerprint: str, text: str) -> str:
+        return hashlib.sha256(
+            (cls.VERSION + "\0" + fingerprint + "\0" + text).encode("utf-8", "surrogatepass")
+        ).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            value = self.memory.get(key)
+            if value is not None:
+                self.memory.move_to_end(key)
+            elif self.db is not None:
+                row = self.db.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    value = row[0]
+                    self.put_memory(key=key, value=value)
+
+            if value is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+
+        return json.loads(value.decode("utf-8", "surrogatepass"))
+
+    def put(self, key: str, result: Dict[str, Any]):
+        self.put_many(keys=[key], results=[result])
+
+    def put_many(self, keys: List[str], results: List[Dict[str, Any]]):
+        """put the results of a batch, written to the on-disk tier in one transaction"""
+        values = [json.dumps(result, ensure_ascii=False).encode("utf-8", "surrogatepass") for result in results]
+
+        with self.lock:
+            for key, value in zip(keys, values):
+                self.put_memory(key=key, value=value)
+            if self.db is not None and values:
+                self.db.executemany("INSERT OR REPLACE INTO results (key, value) VALUES (?, ?)", zip(keys, values))
+                self.db.commit()
+
+    def put_memory(self, key: str, value: bytes):
+        """put into the LRU tier and evict the least recently used values over the size limit; called under the lock"""
+        if key in self.memory:
+            self.memory_bytes -= len(self.memory.pop(key))
+
+        if len(value) > self.max_memory_bytes:
+            return
+
+        self.memory[key] = value
+        self.memory_bytes += len(value)
+        while self.memory_bytes > self.max_memory_bytes:
+            _, evicted_value = self.memory.popitem(last=False)
+            self.memory_bytes -= len(evicted_value)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "memory_items": len(self.memory),
+            "memory_bytes": self.memory_bytes
+        }
@@ -0,0 +1,190 @@
+from ner_utils import BaseNER, RegexFinder, GazetteerFinder, InclusionSymbols, CorpusCommonTokensFinder
+import argparse
+import gc
+import hashlib
+import json
+import os
+import pickle
+import re
+import sys
+import time
+
+from typing import List, Optional
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_ARTIFACTS_DIR = os.path.join(PACKAGE_DIR, "ner_cache")
+
+# bump when the rules built by build_rule_modules change without a change of their source files
+VERSION = "1"
+
+# resource files the rules are built from, relative to the package
+SOURCE_FILES = [
+    "coding_names.txt",
+    "formats.txt",
+    "web_extentions.txt",
+    "latin.txt",
+    "math_symbols.txt",
+    "FDA-parsed-additives.json",
+]
+# the pickled modules depend on the classes layout too
+CODE_FILES = ["ner_utils.py", "rule_artifacts.py"]
+# names of the artifacts, see artifact_path
+ARTIFACT_FILENAME_PATTERN = re.compile(r"rules-[0-9a-f]{16}\.pkl")
+
+
+def read_resource(filename: str) -> str:
+    with open(os.path.join(PACKAGE_DIR, filename), "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def sources_hash() -> str:
+    """hash of the artifact version and of the source and code files, the artifact is rebuilt when it changes"""
+    sha = hashlib.sha256(VERSION.encode("utf-8"))
+    for filename in SOURCE_FILES + CODE_FILES:
+        with open(os.path.join(PACKAGE_DIR, filename), "rb") as f:
+            sha.update(filename.encode("utf-8") + b"\0" + hashlib.sha256(f.read()).digest())
+    return sha.hexdigest()
+
+
+def artifact_path(artifacts_dir: str = DEFAULT_ARTIFACTS_DIR) -> str:
+    return os.path.join(artifacts_dir, f"rules-{sources_hash()[:16]}.pkl")
+
+
+def build_rule_modules() -> List[BaseNER]:
+    """build the rule-based modules of the metric from the resource files"""
+    coding_names = read_resource("coding_names.txt").split("\n")
+    coding_names = [x.strip().lower() for x in coding_names if x.strip()]
+
+    fileformats = read_resource("formats.txt").split("\n")
+    fileformats = [x.lower() for x in fileformats if x]
+    fileformats = [x[1:] if x.startswith(".") else x for x in fileformats if x]
+    fileformats_extensions_pattern = "|".join([re.escape(ext) for ext in fileformats])
+    fileformats_regex_pattern = r'\b\w+\.(?:' + fileformats_extensions_pattern + r')\b'
+
+    web_extensions = read_resource("web_extentions.txt").split("\n")
+    web_extensions = [x for x in web_extensions if x]
+
+    latin_phrases = [s.lower() for s in read_resource("latin.txt").split("\n") if s]
+
+    return [
+        RegexFinder(
+            pattern=r"([\'\"\`])(.*)\1",
+            labelname="Quote"
+        ),
+        RegexFinder(
+            pattern='https?://(?:[-\w.]|(?:%[\da-fA-F]{2}))+',
+            labelname="URL"
+        ),
+        RegexFinder(
+            pattern=r'\b(?:M{0,4})(?:CM|CD|D?C{0,3})(?:XC|XL|L?X{0,3})(?:IX|IV|V?I{0,3})\b',
+            labelname='RomanInteger'
+        ),
+        # CorpusCommonTokensFinder(
+        #     comon_tokens_list=json.loads(read_resource("ukr_corpus_words.json"))
+        # ),
+        CorpusCommonTokensFinder(
+            comon_tokens_list=json.loads(read_resource("FDA-parsed-additives.json"))
+        ),
+        InclusionSymbols(
+            inclusion_symbols_list=[s.strip() for s in read_resource("math_symbols.txt").split("\n") if s]
+        ),
+        RegexFinder(
+            pattern=r'[⁰¹²³⁴⁵⁶⁷⁸⁹]',
+            labelname="MathPower"
+        ),
+        RegexFinder(
+            pattern="^#[\w]+",
+            labelname="Hashtag"
+        ),
+        GazetteerFinder(
+            phrases=coding_names,
+            labelname="Coding",
+            do_lowercase=True
+        ),
+        RegexFinder(
+            pattern=fileformats_regex_pattern,
+            labelname="FileName",
+            do_lowercase=True
+        ),
+        CorpusCommonTokensFinder(
+            comon_tokens_list=fileformats + [
+                "." + fileformat_name for fileformat_name in fileformats
+            ]
+        ),
+        GazetteerFinder(
+            phrases=web_extensions,
+            labelname="Website",
+            prefix_class=r"[\w.-]"
+        ),
+        GazetteerFinder(
+            phrases=latin_phrases,
+            labelname="Latin",
+            do_lowercase=True
+        )
+    ]
+
+
+def build_artifact(artifacts_dir: str = DEFAULT_ARTIFACTS_DIR) -> str:
+    """build the rule-based modules and save them into the artifact, returns its path"""
+    path = artifact_path(artifacts_dir)
+    os.makedirs(artifacts_dir, exist_ok=True)
+
+    # written to a temporary file first, so concurrent processes never read a partial artifact
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(build_rule_modules(), f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+    # the artifacts of the previous source files are never read again
+    for filename in os.listdir(artifacts_dir):
+        if ARTIFACT_FILENAME_PATTERN.fullmatch(filename) and filename != os.path.basename(path):
+            try:
+                os.remove(os.path.join(artifacts_dir, filename))
+            except FileNotFoundError:
+                # removed by a concurrent build
+                pass
+
+    return path
+
+
+def load_rule_modules(artifacts_dir: Optional[str] = DEFAULT_ARTIFACTS_DIR) -> List[BaseNER]:
+    """load the rule-based modules from the artifact of the current source files, build it first if it is missing.
+    If artifacts_dir is None, the modules are built without the artifact"""
+    if artifacts_dir is None:
+        return build_rule_modules()
+
+    path = artifact_path(artifacts_dir)
+    if not os.path.exists(path):
+        try:
+            build_artifact(artifacts_dir)
+        except OSError:
+            # read-only package directory, nothing to cache into
+            return build_rule_modules()
+
+    with open(path, "rb") as f:
+        data = f.read()
+
+    # the automata are many small containers, the cyclic GC would otherwise run many times while they are created
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return pickle.loads(data)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="build the artifact with the rule-based modules of the metric")
+    parser.add_argument("--artifacts_dir", default=DEFAULT_ARTIFACTS_DIR)
+    args = parser.parse_args()
+
+    path = build_artifact(args.artifacts_dir)
+
+    start_time = time.perf_counter()
+    rule_modules = load_rule_modules(args.artifacts_dir)
+    print(f"{path}: {len(rule_modules)} modules, loaded in {time.perf_counter() - start_time:.4f} s", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+from metric_accumulator import MetricAccumulator
+from typing import Iterator, Optional, Tuple, Any
+import argparse
+import collections
+import csv
+import json
+import sys
+import time
+
+
+def read_texts(file, input_format: str, text_field: str, id_field: Optional[str]) -> Iterator[Tuple[Any, str]]:
+    """yield (id, text) from a JSONL / JSON / CSV / plain text file one by one. Without id_field the id is the line
+    number (the index in the JSON array).
+    A JSON file is an array of records or of strings, it is read into memory at once, unlike the other formats"""
+    if input_format == "json":
+        for i, record in enumerate(json.load(file)):
+            if isinstance(record, str):
+                yield i, record
+            else:
+                yield record[id_field] if id_field else i, record[text_field]
+    elif input_format == "jsonl":
+        for i, line in enumerate(file):
+            if line.strip():
+                record = json.loads(line)
+                yield record[id_field] if id_field else i, record[text_field]
+    elif input_format == "csv":
+        csv.field_size_limit(sys.maxsize)
+        for i, row in enumerate(csv.DictReader(file)):
+            yield row[id_field] if id_field else i, row[text_field]
+    else:
+        for i, line in enumerate(file):
+            yield i, line.rstrip("\n")
+
+
+def guess_format(path: str) -> str:
+    for extension, input_format in [(".jsonl", "jsonl"), (".ndjson", "jsonl"), (".json", "json"), (".csv", "csv")]:
+        if path.endswith(extension):
+            return input_format
+    return "txt"
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Calculate the metric over a JSONL / CSV / plain text file (one text per line) or stdin, streaming"
+    )
+    parser.add_argument("input", help="input file path, '-' for stdin")
+    parser.add_argument("--format", choices=["jsonl", "json", "csv", "txt"], default=None,
+                        help="input format, guessed from the file extension by default")
+    parser.add_argument("--text_field", default="text", help="field with the text in JSONL / CSV")
+    parser.add_argument("--id_field", default=None, help="field with the text id in JSONL / CSV, written to the output")
+    parser.add_argument("--output", default=None,
+                        help="path of the per-text results NDJSON, '-' for stdout (the final report then goes to stderr)")
+    parser.add_argument("--chunk_size", type=int, default=1024, help="number of texts held in memory at once")
+    parser.add_argument("--batch_size", type=int, default=32, help="number of texts passed through the models together")
+    parser.add_argument("--max_document_chars", type=int, default=None,
+                        help="analyze only the beginning of longer texts, the truncation is counted in the report")
+    parser.add_argument("--window_chars", type=int, default=None,
+                        help="pass longer texts through stanza window by window, so the memory does not grow with them")
+    args = parser.parse_args()
+
+    from loaders import load_metric
+
+    input_format = args.format or guess_format(args.input)
+    input_file = sys.stdin if args.input == "-" else open(args.input, "r", encoding="utf-8", newline="" if input_format == "csv" else None)
+    output_file = None
+    if args.output:
+        output_file = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+
+    metric = load_metric(max_document_chars=args.max_document_chars, window_chars=args.window_chars)
+
+    # ids of the texts that were read, but not written yet
+    texts_ids = collections.deque()
+
+    def texts_reader():
+        for text_id, text in read_texts(file=input_file, input_format=input_format,
+                                        text_field=args.text_field, id_field=args.id_field):
+            texts_ids.append(text_id)
+            yield text
+
+    accumulator = MetricAccumulator()
+    start_time = time.perf_counter()
+
+    for chunk_accumulator in metric.accumulate_stream(texts=texts_reader(), chunk_size=args.chunk_size,
+                                                      batch_size=args.batch_size, keep_texts=output_file is not None):
+        if output_file is not None:
+            for text_record in chunk_accumulator.texts_records:
+                output_file.write(json.dumps(dict(id=texts_ids.popleft(), **text_record), ensure_ascii=False) + "\n")
+            output_file.flush()
+        else:
+            texts_ids.clear()
+
+        report = accumulator.merge(chunk_accumulator.drop_texts()).report()
+        elapsed = time.perf_counter() - start_time
+        print(
+            f"{report['total_num_texts']} texts, {report['total_num_texts'] / elapsed:.1f} texts/s, "
+            f"{report['total_num_tokens'] / elapsed:.1f} tokens/s, "
+            f"codeswitch_texts_ratio={report['codeswitch_texts_ratio']:.4f}, "
+            f"ner_skip_rate={report['ner_skip_rate']:.4f}, "
+            f"ner_dedup_ratio={report['ner_dedup_ratio']:.4f}",
+            file=sys.stderr
+        )
+
+    if output_file is not None and output_file is not sys.stdout:
+        output_file.close()
+
+    # stdout has only the per-text results when they are written there
+    print(json.dumps(accumulator.report(), ensure_ascii=False), file=sys.stderr if output_file is sys.stdout else sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+from instrumentation import process_memory
+from threads import pin_threads
+import argparse
+import gc
+import importlib
+import json
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+
+from typing import Callable, Dict, List, Any, Optional
+
+
+def freeze_loaded_objects():
+    """prepare the loaded metric for forking: the torch models are switched to inference without gradients, so their
+    tensors are only read, and all the objects are moved into the permanent GC generation (gc.freeze), so the
+    collections in the workers do not write into the pages of the parent objects"""
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        for obj in gc.get_objects():
+            if isinstance(obj, torch.nn.Module):
+                obj.eval()
+                obj.requires_grad_(False)
+
+    gc.collect()
+    gc.freeze()
+
+
+class WorkerSupervisor:
+    """Forks n_workers processes that run the target and forks a new one whenever a worker exits, until the supervisor
+    gets SIGTERM / SIGINT: then it passes SIGTERM to the workers and waits for them"""
+
+    def __init__(self, target: Callable[[], None], n_workers: int, min_uptime: float = 5.0, restart_delay: float = 1.0):
+        """
+        target: function run in every worker process
+        n_workers: int, number of worker processes
+        min_uptime: float, seconds; a worker that exits sooner is restarted after restart_delay seconds, so a worker
+            that fails at start does not restart in a busy loop
+        """
+        self.target = target
+        self.n_workers = n_workers
+        self.min_uptime = min_uptime
+        self.restart_delay = restart_delay
+        self.stopping = False
+        # pid: start time
+        self.workers = {}
+
+    def spawn(self) -> int:
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            exit_code = 0
+            try:
+                self.target()
+            except BaseException:
+                traceback.print_exc()
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+
+        self.workers[pid] = time.monotonic()
+        return pid
+
+    def stop(self, signum=None, frame=None):
+        self.stopping = True
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        for _ in range(self.n_workers):
+            self.spawn()
+
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, 0)
+            except ChildProcessError:
+                break
+
+            start_time = self.workers.pop(pid, None)
+            if start_time is None or self.stopping:
+                continue
+
+            print(f"worker {pid} exited with code {os.waitstatus_to_exitcode(status)}, restarting", file=sys.stderr)
+            if time.monotonic() - start_time < self.min_uptime:
+                time.sleep(self.restart_delay)
+            if not self.stopping:
+                self.spawn()
+
+
+def serve(host: str = "0.0.0.0", port: int = 8008, n_workers: int = 1, threads_per_worker: int = 1,
+          preload: bool = True):
+    """run the app.py server in n_workers processes on one listening socket.
+    With preload the metric is loaded once in this process and the workers are forked from it, sharing the pages of the
+    models and of the rule tables copy-on-write; without it every worker loads its own metric in background, as with
+    uvicorn --workers"""
+    listening_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listening_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listening_socket.bind((host, port))
+    listening_socket.listen(2048)
+    listening_socket.set_inheritable(True)
+
+    pin_threads(1)
+
+    # the app module (with its batcher and instrumentation) is imported before the fork, so it is shared too
+    import uvicorn
+    import app as app_module
+    from loaders import load_metric
+
+    if preload:
+        timings = {}
+        app_module.set_metric(metric=load_metric(timings=timings, **app_module.load_metric_kwargs()), timings=timings)
+        print(f"metric loaded in {timings['total']:.1f} s", file=sys.stderr)
+        freeze_loaded_objects()
+
+    def run_worker():
+        pin_threads(threads_per_worker)
+        uvicorn.Server(uvicorn.Config(app_module.app, log_level="info")).run(sockets=[listening_socket])
+
+    WorkerSupervisor(target=run_worker, n_workers=n_workers).run()
+
+
+def measure_workers_memory(loader: Callable[[], Any], n_workers: int, preload: bool,
+                           texts: List[str]) -> Dict[str, Any]:
+    """resident memory of this process and of n_workers forked workers after each of them ran the texts through the
+    metric. With preload the metric is loaded once before the fork, without it every worker loads its own"""
+    metric = None
+    if preload:
+        metric = loader()
+        freeze_loaded_objects()
+
+    read_fd, write_fd = os.pipe()
+    pids = []
+    for _ in range(n_workers):
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            status = b"1"
+            try:
+                (metric or loader()).calculate(texts=texts, batch_size=32)
+            except BaseException:
+                traceback.print_exc()
+                status = b"0"
+            os.write(write_fd, status)
+            # the memory is read while the worker waits, then it is terminated
+            signal.pause()
+            os._exit(0)
+        pids.append(pid)
+    os.close(write_fd)
+
+    statuses = b""
+    while len(statuses) < n_workers:
+        data = os.read(read_fd, n_workers)
+        if not data:
+            break
+        statuses += data
+    os.close(read_fd)
+
+    workers_memory = [process_memory(pid) for pid in pids]
+    parent_memory = process_memory()
+    for pid in pids:
+        os.kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)
+
+    if statuses != b"1" * n_workers:
+        raise RuntimeError("a worker failed to run the metric")
+
+    def mean(kind: str) -> Optional[float]:
+        values = [memory[kind] for memory in workers_memory if kind in memory]
+        return sum(values) / len(values) if values else None
+
+    return {
+        "preload": preload,
+        "n_workers": n_workers,
+        "parent": parent_memory,
+        "workers": workers_memory,
+        "worker_mean": {kind: mean(kind) for kind in ["rss", "pss", "shared", "private"]},
+        # the memory the whole group actually takes, the shared pages are counted once
+        "total_pss": parent_memory.get("pss", 0) + sum(memory.get("pss", 0) for memory in workers_memory)
+    }
+
+
+def import_function(path: str) -> Callable:
+    """function by its "module:function" path"""
+    module_name, _, function_name = path.partition(":")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve the metric with several worker processes forked from one process that loaded it, "
+                    "or measure the per-worker memory of this layout"
+    )
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8008)
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("METRIC_WORKERS", 1)))
+    parser.add_argument("--threads_per_worker", type=int, default=1, help="torch / BLAS threads of every worker")
+    parser.add_argument("--no_preload", action="store_true",
+                        help="every worker loads its own metric (the layout of uvicorn --workers)")
+    parser.add_argument("--measure_memory", action="store_true",
+                        help="do not serve: fork the workers, run texts through the metric in each of them and print "
+                             "the resident memory of every process as JSON")
+    parser.add_argument("--loader", default="loaders:load_metric",
+                        help="module:function that builds the metric for --measure_memory, e.g. "
+                             "benchmark:build_stub_metric to measure without the models")
+    parser.add_argument("--num_texts", type=int, default=200, help="synthetic texts every worker runs for --measure_memory")
+    args = parser.parse_args()
+
+    if not args.measure_memory:
+        serve(host=args.host, port=args.port, n_workers=args.workers, threads_per_worker=args.threads_per_worker,
+              preload=not args.no_preload)
+        return
+
+    pin_threads(args.threads_per_worker)
+    from benchmark import generate_texts
+
+    print(json.dumps(measure_workers_memory(
+        loader=import_function(args.loader),
+        n_workers=args.workers,
+        preload=not args.no_preload,
+        texts=generate_texts(num_texts=args.num_texts)
+    ), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+from preprocessing import Preprocessor
+from metric_accumulator import MetricAccumulator
+from benchmark import generate_texts, StubSentenceNER
+import random
+import re
+import warnings
+
+from typing import List, Dict, Any, Tuple
+
+REPORT_KEYS = [
+    "codeswitch_sentences_ratio", "codeswitch_texts_ratio", "total_num_texts", "total_num_sentences",
+    "codeswitch_words_ratio", "total_num_tokens"
+]
+
+
+class TouchingSentenceNER(StubSentenceNER):
+    """splitter whose sentences touch each other (no gap between them)"""
+    sentence_pattern = re.compile(r"[^.!?]*[.!?]+|[^.!?]+$")
+
+
+def corner_case_texts(num_texts: int = 500, seed: int = 1) -> List[str]:
+    """short texts mixing native, foreign and rule-matched pieces, glued with and without spaces and dots"""
+    texts = [
+        "", "   ", "123 456.", "— — !", "XIV.", "Привіт. 5² + 3.", "E471 E472.", "Ок. ascii.", "Привіт.Hello world.",
+        "'Це'.Hello", "XIV.V", "5².x²", "main.py.Тест", "<b>Café</b> і naïve"
+    ]
+    rng = random.Random(seed)
+    alphabet = "аб вг Hello XIV .!? ' 5² python E471 .com".split(" ")
+    texts += [
+        "".join(rng.choice(alphabet) + rng.choice(["", " ", "."]) for _ in range(rng.randint(1, 12)))
+        for _ in range(num_texts)
+    ]
+    return texts
+
+
+def sample_texts() -> List[str]:
+    return generate_texts(num_texts=300, entity_density=0.05, codeswitch_density=0.03, seed=5) + corner_case_texts()
+
+
+def legacy_analyze_text(metric, text: str) -> Dict[str, Any]:
+    """the per-text path of CodeSwitchingNERMetric.calculate before the batching: the sentence splitter and every NER
+    module (through its dict API) on the text alone, then merge_preds, is_sent_in_required_lang_ner,
+    calc_token_level_num_broken and calc_sentences_num_broken"""
+    sentence_ner_preds, sentences, sentences_ranges, tokens_dicts = metric.sentence_ner.pred_ner_sents(text)
+    for ner_module in metric.ner_modules:
+        module_preds = ner_module(sentences=sentences, sentences_ranges=sentences_ranges, tokens_dicts=tokens_dicts)
+        for i in range(len(module_preds)):
+            sentence_ner_preds[i] += module_preds[i]
+
+    merged_ner_preds = [metric.merge_preds(text=text, preds=preds) for preds in sentence_ner_preds]
+    sents_correct_langs = [
+        metric.is_sent_in_required_lang_ner(sent_text=sentences[i], sent_range_dict=sentences_ranges[i], sent_ner_preds=preds)
+        for i, preds in enumerate(merged_ner_preds)
+    ]
+    merged_ner_preds = [
+        preds if is_sent_correct_lang else [] for preds, is_sent_correct_lang in zip(merged_ner_preds, sents_correct_langs)
+    ]
+
+    num_broken_tokens, broken_tokens_dicts = metric.calc_token_level_num_broken(
+        tokens=tokens_dicts,
+        merged_ner_preds=merged_ner_preds,
+        sents_correct_langs=sents_correct_langs,
+        sentences_ranges=sentences_ranges
+    )
+
+    return {
+        "num_sentences": len(sentences),
+        "num_tokens": len(tokens_dicts),
+        "num_broken_tokens": num_broken_tokens,
+        "broken_tokens": [[token_dict["start"], token_dict["end"]] for token_dict in broken_tokens_dicts],
+        "num_broken_sentences": metric.calc_sentences_num_broken(
+            broken_tokens_dicts=broken_tokens_dicts, sentences_ranges=sentences_ranges
+        )
+    }
+
+
+def legacy_calculate(metric, texts: List[str]) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """report and per-text records of the legacy per-text path, see legacy_analyze_text"""
+    records = []
+    with warnings.catch_warnings():
+        # the per-text methods are deprecated, they are only run here to pin their results
+        warnings.simplefilter("ignore", DeprecationWarning)
+        for raw_text in texts:
+            text = Preprocessor.preprocess(text=raw_text)
+            records.append(
+                legacy_analyze_text(metric, text) if text else
+                {"num_sentences": 0, "num_tokens": 0, "num_broken_tokens": 0, "broken_tokens": [], "num_broken_sentences": 0}
+            )
+
+    total_num_sentences = sum(record["num_sentences"] for record in records)
+    total_num_tokens = sum(record["num_tokens"] for record in records)
+    num_broken_texts = sum(1 for record in records if record["num_broken_tokens"])
+    report = {
+        "codeswitch_sentences_ratio": sum(record["num_broken_sentences"] for record in records) / total_num_sentences
+        if total_num_sentences else -1.0,
+        "codeswitch_texts_ratio": num_broken_texts / len(texts) if texts else -1.0,
+        "total_num_texts": len(texts),
+        "total_num_sentences": total_num_sentences,
+        "codeswitch_words_ratio": sum(record["num_broken_tokens"] for record in records) / total_num_tokens
+        if total_num_tokens else -1.0,
+        "total_num_tokens": total_num_tokens
+    }
+
+    return report, records
+
+
+def batched_calculate(metric, texts: List[str], batch_size: int) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """report and per-text records of the batched path, in the shape of legacy_calculate"""
+    accumulator = MetricAccumulator(metric=metric, keep_texts=True)
+    accumulator.update(texts=texts, batch_size=batch_size)
+    report = accumulator.report()
+
+    return {key: report[key] for key in REPORT_KEYS}, [
+        {
+            "num_sentences": record["num_sentences"],
+            "num_tokens": record["num_tokens"],
+            "num_broken_tokens": len(record["broken_tokens"]),
+            "broken_tokens": record["broken_tokens"],
+            "num_broken_sentences": len(record["broken_sentences"])
+        } for record in accumulator.texts_records
+    ]
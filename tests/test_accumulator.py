@@ -0,0 +1,31 @@
+from benchmark import build_stub_metric, generate_texts
+from metric_accumulator import MetricAccumulator
+
+import pytest
+
+
+def test_merged_shards_match_one_pass():
+    metric = build_stub_metric()
+    metric.deduplicate_sentences = False
+    texts = generate_texts(num_texts=100, codeswitch_density=0.1, seed=3) + ["", " "]
+
+    full = MetricAccumulator(metric=metric, keep_texts=True)
+    full.update(texts=texts, batch_size=16)
+
+    merged = MetricAccumulator(keep_texts=True)
+    for shard_start in range(0, len(texts), 30):
+        shard = MetricAccumulator(metric=metric, keep_texts=True)
+        shard.update(texts=texts[shard_start: shard_start + 30], batch_size=16)
+        merged.merge(MetricAccumulator.from_dict(shard.to_dict()))
+
+    assert merged.report() == full.report()
+    assert merged.texts_records == full.texts_records
+
+
+def test_merge_requires_the_same_keep_texts():
+    with pytest.raises(ValueError):
+        MetricAccumulator().merge(MetricAccumulator(keep_texts=True))
+
+    accumulator = MetricAccumulator(keep_texts=True)
+    accumulator.add_text_result(text_result=None)
+    assert MetricAccumulator().merge(accumulator.drop_texts()).report()["total_num_texts"] == 1
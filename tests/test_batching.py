@@ -0,0 +1,26 @@
+from benchmark import build_stub_metric, StubSentenceNER
+from legacy_metric import TouchingSentenceNER, sample_texts, legacy_calculate, batched_calculate
+
+import pytest
+
+
+@pytest.fixture(scope="module")
+def texts():
+    return sample_texts()
+
+
+@pytest.mark.parametrize("splitter", [StubSentenceNER, TouchingSentenceNER])
+@pytest.mark.parametrize("batch_size", [1, 16, 1000])
+def test_batched_pipeline_matches_legacy_per_text_path(texts, splitter, batch_size):
+    metric = build_stub_metric()
+    metric.sentence_ner = splitter()
+
+    assert batched_calculate(metric, texts, batch_size=batch_size) == legacy_calculate(metric, texts)
+
+
+def test_per_text_methods_are_deprecated():
+    metric = build_stub_metric()
+    with pytest.deprecated_call():
+        metric.calc_sentences_num_broken(broken_tokens_dicts=[], sentences_ranges=[])
+    with pytest.deprecated_call():
+        metric.merge_preds(text="", preds=[])
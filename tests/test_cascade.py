@@ -0,0 +1,19 @@
+from benchmark import build_stub_metric, StubSentenceNER
+from legacy_metric import TouchingSentenceNER, sample_texts, legacy_calculate, batched_calculate
+
+import pytest
+
+
+@pytest.fixture(scope="module")
+def texts():
+    return sample_texts()
+
+
+@pytest.mark.parametrize("splitter", [StubSentenceNER, TouchingSentenceNER])
+@pytest.mark.parametrize("skip_native_sentences", [True, False])
+def test_cascade_matches_legacy_per_text_path(texts, splitter, skip_native_sentences):
+    metric = build_stub_metric(cascade=True)
+    metric.sentence_ner = splitter()
+    metric.skip_native_sentences = skip_native_sentences
+
+    assert batched_calculate(metric, texts, batch_size=16) == legacy_calculate(metric, texts)
@@ -0,0 +1,23 @@
+from benchmark import build_stub_metric, generate_texts
+from legacy_metric import legacy_calculate, batched_calculate
+
+import pytest
+
+
+@pytest.mark.parametrize("cascade", [False, True])
+def test_deduplication_matches_legacy_per_text_path(cascade):
+    texts = generate_texts(num_texts=200, repeat_density=0.5, codeswitch_density=0.2, seed=5)
+    metric = build_stub_metric(cascade=cascade)
+    metric.deduplicate_sentences = True
+
+    assert batched_calculate(metric, texts, batch_size=32) == legacy_calculate(metric, texts)
+    assert metric.dedup_stats()["dedup_ratio"] > 0
+
+
+def test_report_has_the_skip_and_dedup_ratios():
+    texts = generate_texts(num_texts=200, repeat_density=0.5, codeswitch_density=0.2, seed=5)
+    metric = build_stub_metric()
+    report = metric.calculate(texts=texts, batch_size=32)
+
+    assert report["ner_skip_rate"] == metric.ner_skip_stats()["skip_rate"] > 0
+    assert report["ner_dedup_ratio"] == metric.dedup_stats()["dedup_ratio"] > 0
@@ -0,0 +1,95 @@
+from ner_utils import RegexFinder, GazetteerFinder
+from rule_artifacts import read_resource
+from document import Document
+from benchmark import StubSentenceNER, UKRAINIAN_WORDS, ENGLISH_WORDS
+import random
+import re
+
+import pytest
+
+FILLERS = UKRAINIAN_WORDS + ENGLISH_WORDS + [".", ",", "-", "_", "'", "(", ")", "a", "x.", "-y", "com", "ua"]
+
+
+def resource_lines(filename: str):
+    return [line for line in read_resource(filename).split("\n") if line.strip()]
+
+
+def coding_finders():
+    phrases = [line.strip().lower() for line in resource_lines("coding_names.txt")]
+    return (
+        phrases,
+        GazetteerFinder(phrases=phrases, labelname="Coding", do_lowercase=True),
+        RegexFinder(pattern="|".join(re.escape(phrase) for phrase in phrases), labelname="Coding", do_lowercase=True)
+    )
+
+
+def website_finders():
+    phrases = resource_lines("web_extentions.txt")
+    return (
+        phrases,
+        GazetteerFinder(phrases=phrases, labelname="Website", prefix_class=r"[\w.-]"),
+        RegexFinder(
+            pattern=r"\b[\w.-]+(?:" + "|".join(re.escape(phrase) for phrase in phrases) + r")\b",
+            labelname="Website"
+        )
+    )
+
+
+def latin_finders():
+    phrases = [line.lower() for line in resource_lines("latin.txt")]
+    return (
+        phrases,
+        GazetteerFinder(phrases=phrases, labelname="Latin", do_lowercase=True),
+        RegexFinder(pattern="|".join(re.escape(phrase) for phrase in phrases), labelname="Latin", do_lowercase=True)
+    )
+
+
+def random_sentences(rng: random.Random, phrases, num_sentences: int):
+    """sentences of filler words with phrases of the list, glued to the words around them now and then"""
+    sentences = []
+    for _ in range(num_sentences):
+        parts = []
+        for _ in range(rng.randint(1, 12)):
+            part = rng.choice(phrases) if rng.random() < 0.3 else rng.choice(FILLERS)
+            if rng.random() < 0.3:
+                part = part.upper() if rng.random() < 0.5 else part.capitalize()
+            parts.append(part)
+            parts.append(rng.choice([" ", " ", " ", "", ".", "-"]))
+        sentences.append("".join(parts).strip() or "x")
+    return sentences
+
+
+@pytest.mark.parametrize("make_finders", [coding_finders, website_finders, latin_finders])
+def test_gazetteer_matches_regex(make_finders):
+    phrases, gazetteer, regex = make_finders()
+    sentences = random_sentences(random.Random(0), phrases, num_sentences=300)
+    sentences_ranges = []
+    start = 0
+    for sentence in sentences:
+        sentences_ranges.append({"start": start, "end": start + len(sentence)})
+        start += len(sentence) + 1
+
+    gazetteer_preds = gazetteer(sentences=sentences, sentences_ranges=sentences_ranges)
+    regex_preds = regex(sentences=sentences, sentences_ranges=sentences_ranges)
+    assert gazetteer_preds == regex_preds
+    assert any(gazetteer_preds)
+
+
+@pytest.mark.parametrize("make_finders", [coding_finders, website_finders, latin_finders])
+def test_predict_spans_matches_dict_api(make_finders):
+    phrases, gazetteer, regex = make_finders()
+    splitter = StubSentenceNER()
+    texts = [" ".join(random_sentences(random.Random(seed), phrases, num_sentences=5)) for seed in range(40)]
+    document = Document(texts=texts, texts_sents=[splitter.pred_ner_sents(text) for text in texts])
+    sentences_idxs = list(range(len(document.sentences)))
+
+    for finder in (gazetteer, regex):
+        spans = finder.predict_spans(document=document, sentences_idxs=sentences_idxs)
+        preds = finder(
+            sentences=document.sentences,
+            sentences_ranges=document.sentences_ranges(sentences_idxs),
+            lowercased_sentences=document.lowercased_sentences
+        )
+        assert list(zip(spans.sentences_idxs, spans.starts, spans.ends, spans.labels)) == [
+            (i, pred["start"], pred["end"], pred["label"]) for i, sentence_preds in enumerate(preds) for pred in sentence_preds
+        ]
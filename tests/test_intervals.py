@@ -0,0 +1,43 @@
+from intervals import IntervalIndex
+import random
+
+import pytest
+
+
+def is_intersection(start_1: int, end_1: int, start_2: int, end_2: int) -> bool:
+    """the pairwise check of CodeSwitchingNERMetric the index replaces"""
+    return not (end_1 < start_2 or start_1 > end_2)
+
+
+def random_intervals(rng: random.Random, num_intervals: int, max_position: int):
+    intervals = []
+    for _ in range(num_intervals):
+        start = rng.randrange(max_position)
+        intervals.append((start, start + rng.randrange(0, 12)))
+    return intervals
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_index_matches_pairwise_checks(seed):
+    rng = random.Random(seed)
+    intervals = random_intervals(rng, num_intervals=rng.randint(0, 40), max_position=100)
+    index = IntervalIndex(intervals)
+
+    for start, end in random_intervals(rng, num_intervals=200, max_position=110):
+        assert index.intersects(start=start, end=end) == any(
+            is_intersection(start, end, interval_start, interval_end) for interval_start, interval_end in intervals
+        )
+
+        containing = [
+            i for i, (interval_start, interval_end) in enumerate(intervals)
+            if interval_start <= start and end <= interval_end
+        ]
+        assert index.containing(start=start, end=end) == containing
+        assert index.first_containing(start=start, end=end) == (containing[0] if containing else None)
+
+
+def test_empty_index():
+    index = IntervalIndex([])
+    assert not index.intersects(start=0, end=10)
+    assert index.containing(start=0, end=10) == []
+    assert index.first_containing(start=0, end=10) is None
@@ -0,0 +1,39 @@
+from preprocessing import Preprocessor
+import random
+
+import pytest
+
+# codepoint ranges the random texts are drawn from: ASCII, Latin with accents, combining marks, Cyrillic,
+# Latin Extended Additional, punctuation, Hangul and the whole Unicode range
+ALPHABETS = [
+    (0x0000, 0x0080), (0x0080, 0x0250), (0x0300, 0x0370), (0x0400, 0x0530),
+    (0x1E00, 0x1F00), (0x2000, 0x2100), (0xAC00, 0xAD00), (0x0000, 0x110000)
+]
+
+
+def remove_accents_keep_ukr_symbols_loop(text: str) -> str:
+    """the symbol by symbol implementation, to check the table against"""
+    return "".join(Preprocessor.remove_accents_keep_ukr_symbol(symbol=symbol) for symbol in text)
+
+
+def random_text(rng: random.Random, max_length: int = 30) -> str:
+    text = "".join(chr(rng.randrange(*rng.choice(ALPHABETS))) for _ in range(rng.randint(0, max_length)))
+    # lone surrogates are replaced, as they are in the decoded request texts
+    return text.encode("utf-8", "surrogatepass").decode("utf-8", "replace")
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_symbols_table_matches_symbol_by_symbol(seed):
+    rng = random.Random(seed)
+    for _ in range(5000):
+        text = random_text(rng)
+        assert Preprocessor.remove_accents_keep_ukr_symbols(text) == remove_accents_keep_ukr_symbols_loop(text), text
+
+
+def test_ukrainian_letters_are_kept():
+    text = "Йолоп їсть єнота, Ї́жак і Є́вген — ю́ля"
+    assert Preprocessor.remove_accents_keep_ukr_symbols(text) == "Йолоп їсть єнота, Їжак і Євген — юля"
+
+
+def test_preprocess_removes_html_and_accents():
+    assert Preprocessor.preprocess("<p>Café <b>naïve</b></p>") == "Cafe naive"
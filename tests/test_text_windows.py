@@ -0,0 +1,18 @@
+from ner_utils import split_text_windows
+import random
+
+import pytest
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_text_windows_cover_the_text(seed):
+    rng = random.Random(seed)
+    pieces = ["Речення тут.", " ", "\n", "\n\n", "word", "довгеслово" * 5, "! ", "? "]
+    text = "".join(rng.choice(pieces) for _ in range(rng.randint(0, 400)))
+    window_chars = rng.randint(5, 200)
+
+    windows = split_text_windows(text=text, window_chars=window_chars)
+    assert [start for start, _ in windows] == [0] + [end for _, end in windows[:-1]]
+    assert (windows[-1][1] if windows else 0) == len(text)
+    assert all(0 < end - start <= window_chars for start, end in windows)
+
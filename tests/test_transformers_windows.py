@@ -0,0 +1,65 @@
+from ner_utils import TransformersNER
+import random
+import re
+
+import pytest
+
+
+class Encodings(dict):
+    def __init__(self, offsets, words_ids):
+        super().__init__(offset_mapping=offsets)
+        self.words_ids = words_ids
+
+    def word_ids(self, batch_index: int):
+        return self.words_ids[batch_index]
+
+
+class ThreeCharsTokenizer:
+    """fast tokenizer stand-in: every whitespace-separated word is split into subwords of 3 chars"""
+
+    def num_special_tokens_to_add(self) -> int:
+        return 2
+
+    def tokenize(self, text: str):
+        offsets, words_ids = [], []
+        for word_idx, word in enumerate(re.finditer(r"\S+", text)):
+            for start in range(word.start(), word.end(), 3):
+                offsets.append((start, min(start + 3, word.end())))
+                words_ids.append(word_idx)
+        return offsets, words_ids
+
+    def __call__(self, texts, **kwargs):
+        encodings = [self.tokenize(text) for text in texts]
+        return Encodings([offsets for offsets, _ in encodings], [words_ids for _, words_ids in encodings])
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_transformers_windows_fit_max_length(seed):
+    ner = TransformersNER.__new__(TransformersNER)
+    ner.tokenizer = ThreeCharsTokenizer()
+    ner.max_length = 20
+    ner.window_overlap = 5
+
+    rng = random.Random(seed)
+    for _ in range(300):
+        words = ["x" * rng.choice([1, 2, 4, 7, 12, 40, 70]) for _ in range(rng.randint(1, 40))]
+        sentence = " ".join(words)
+        chunks = ner.split_windows(sentences=[sentence])
+
+        covered = set()
+        for chunk in chunks:
+            chunk_text = sentence[chunk["start"]: chunk["end"]]
+            covered.update(range(chunk["start"], chunk["end"]))
+            starts_on_word = chunk["start"] == 0 or sentence[chunk["start"] - 1] == " "
+            ends_on_word = chunk["end"] == len(sentence) or sentence[chunk["end"]] == " "
+            if starts_on_word and ends_on_word:
+                # a window cut on word boundaries is tokenized again into the same subwords
+                assert len(ner.tokenizer.tokenize(chunk_text)[0]) + 2 <= ner.max_length
+            else:
+                # only a word longer than a window is cut
+                cut_position = chunk["start"] if not starts_on_word else chunk["end"]
+                word = re.search(r"\S+", sentence[sentence.rfind(" ", 0, cut_position) + 1:]).group()
+                assert len(ner.tokenizer.tokenize(word)[0]) + 2 > ner.max_length
+
+        assert chunks[-1]["end"] == len(sentence)
+        assert all(i in covered for i, char in enumerate(sentence) if char != " ")
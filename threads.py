@@ -0,0 +1,14 @@
+import os
+import sys
+
+
+def pin_threads(num_threads: int):
+    """number of the torch / BLAS threads of the process. Set before torch is imported, it also keeps the parent from
+    starting an OpenMP pool that the forked workers would inherit in a broken state. Torch is only touched if it is
+    already imported"""
+    for env_name in ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"]:
+        os.environ[env_name] = str(num_threads)
+
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        torch.set_num_threads(num_threads)